@@ -1,15 +1,233 @@
 """The module responsible for connecting and interacting with the pricing microservice."""
 
+from fastapi import HTTPException
 from datetime import datetime
+import asyncio
 import math
 import os
+import time
 import httpx
 
 PRICING_URL = os.getenv("PRICING_URL")
-    
+
+#Rates only change with the garage occupancy, so a short TTL absorbs bursts
+RATE_CACHE_TTL_SECONDS = float(os.getenv("PRICING_CACHE_TTL_SECONDS", "10"))
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+client: httpx.AsyncClient | None = None
+
+
+class CircuitBreaker:
+    """Stops calling the pricing service after `failure_threshold` consecutive failures. After
+    `reset_seconds` a single trial call is let through, and its outcome closes or re-opens the breaker."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+
+
+class RateCurve:
+    """The per minute rates published by the pricing service's `/rates` endpoint, in consecutive
+    buckets from `start`. Prices are computed locally with the pricing service's rule: every
+    started minute is charged at the rate of the bucket it starts in."""
+
+    def __init__(self, start: datetime, bucket_minutes: int, minute_rates: list[float]):
+        self.start = start
+        self.bucket_minutes = bucket_minutes
+        self.minutes = len(minute_rates) * bucket_minutes
+        self.cents = [round(rate * 100) for rate in minute_rates]
+        #Entry `b` is the price in cents of every minute before bucket `b`
+        self.cumulative = [0]
+        for cents in self.cents:
+            self.cumulative.append(self.cumulative[-1] + cents * bucket_minutes)
+
+    def _cents_before(self, minute: int) -> int:
+        bucket, into_bucket = divmod(minute, self.bucket_minutes)
+        if into_bucket == 0:
+            return self.cumulative[bucket]
+        return self.cumulative[bucket] + self.cents[bucket] * into_bucket
+
+    def price(self, res_start: datetime, res_end: datetime) -> float | None:
+        """The price of the reservation, or None when it runs outside the curve"""
+        #The pricing service goes by wall clock time
+        first_minute = res_start.replace(tzinfo=None, second=0, microsecond=0)
+        offset = int((first_minute - self.start).total_seconds() // 60)
+        minutes = _billed_minutes(res_start, res_end)
+        if offset < 0 or offset + minutes > self.minutes:
+            return None
+        return round((self._cents_before(offset + minutes) - self._cents_before(offset)) / 100, 2)
+
+
+_curve: RateCurve | None = None
+_curve_expires_at = 0.0
+#The request already fetching the curve, so a burst of misses makes one call
+_in_flight: asyncio.Future | None = None
+cache_hits = 0
+cache_misses = 0
+quote_fallbacks = 0
+
+
+def init_pricing_client() -> None:
+    """Creates the pooled client shared by every pricing request for the lifetime of the app"""
+    global client
+    client = httpx.AsyncClient(
+        base_url=PRICING_URL,
+        http2=True,
+        follow_redirects=True,
+        timeout=httpx.Timeout(5.0, connect=2.0),
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30)
+    )
+
+
+async def close_pricing_client() -> None:
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def pricing_stats() -> dict:
+    return {
+        "breaker_state": breaker.state,
+        "consecutive_failures": breaker.failures,
+        "cache_hits": cache_hits,
+        "cache_misses": cache_misses,
+        "quote_fallbacks": quote_fallbacks
+    }
+
+
+def _billed_minutes(res_start: datetime, res_end: datetime) -> int:
+    """Total reservation time, rounded up to the nearest minute"""
+    return math.ceil((res_end - res_start).total_seconds() / 60)
+
+
+def _client_error_detail(response: httpx.Response):
+    """The pricing service's reason for rejecting a request. A proxy or gateway may answer with
+    a body that is not the service's JSON, then the generic reason is used."""
+    try:
+        detail = response.json().get("detail")
+    except (ValueError, AttributeError):
+        detail = None
+    return detail or "Invalid reservation interval"
+
+
+async def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    if client is None:
+        init_pricing_client()
+
+    if not breaker.allow():
+        raise HTTPException(status_code=503, detail="Pricing service is unavailable, please try again shortly")
+
+    try:
+        response = await client.request(method, url, **kwargs)
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        #A rejected interval is the caller's error, not an outage of the pricing service
+        if e.response.is_client_error:
+            breaker.record_success()
+            raise HTTPException(status_code=400, detail=_client_error_detail(e.response))
+        breaker.record_failure()
+        raise HTTPException(status_code=503, detail=f"Failed to fetch pricing: {e}")
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        raise HTTPException(status_code=503, detail=f"Failed to fetch pricing: {e}")
+
+    breaker.record_success()
+    return response
+
+
+async def _request_curve() -> RateCurve:
+    response = await _request("GET", "/rates")
+    rates = response.json()
+    return RateCurve(datetime.fromisoformat(rates["start"]), rates["bucket_minutes"], rates["minute_rates"])
+
+
+async def _request_quote(res_start: datetime, res_end: datetime) -> float:
+    response = await _request("POST", "/quote", json={"intervals": [{
+        "start": datetime.isoformat(res_start),
+        "end": datetime.isoformat(res_end)
+    }]})
+    return response.json()["quotes"][0]["total_price"]
+
+
+async def fetch_rate_curve() -> RateCurve:
+    """Returns the pricing service's rate curve for the coming week, cached for a short TTL.
+
+    Raises:
+        HTTPException: 503 when the pricing service fails or its circuit breaker is open
+    """
+    global _curve, _curve_expires_at, _in_flight, cache_hits, cache_misses
+
+    if _curve is not None and _curve_expires_at > time.monotonic():
+        cache_hits += 1
+        return _curve
+
+    if _in_flight is not None:
+        cache_hits += 1
+        return await asyncio.shield(_in_flight)
+
+    cache_misses += 1
+    future = asyncio.get_running_loop().create_future()
+    _in_flight = future
+    try:
+        curve = await _request_curve()
+    except Exception as e:
+        future.set_exception(e)
+        #Mark the exception as retrieved when no other request was waiting on it
+        future.exception()
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+    else:
+        _curve, _curve_expires_at = curve, time.monotonic() + RATE_CACHE_TTL_SECONDS
+        future.set_result(curve)
+        return curve
+    finally:
+        _in_flight = None
+
+
 async def fetch_pricing(res_start: datetime, res_end: datetime) -> float:
     """A function to fetch the price from the pricing MS for a given reservation time.
-    This function fetches the rate/minute and computes the total price.
+    The price is computed locally from the cached rate curve, reservations running past
+    the end of the curve are quoted by the pricing MS instead.
 
     Args:
         res_start (datetime): Reservation start time
@@ -17,21 +235,18 @@ async def fetch_pricing(res_start: datetime, res_end: datetime) -> float:
 
     Returns:
         float: The price for the reservation
+
+    Raises:
+        HTTPException: 503 when the pricing service fails or its circuit breaker is open
     """
-    payload = {
-        "timestamp": datetime.isoformat(res_start)
-    }
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(f"{PRICING_URL}/calculate-rate", follow_redirects=True, json=payload)
-    response.raise_for_status()
-    
-    minute_rate: float = response.json()["minute_rate"]
-
-    #Calculate total reservation time, rounded up to nearest minute
-    time_diff = res_end - res_start
-    total_minutes = math.ceil(time_diff.total_seconds() / 60)
-
-    total_price = round((total_minutes * minute_rate), 2)
-    
-    return total_price
\ No newline at end of file
+    global quote_fallbacks
+
+    if res_end <= res_start:
+        raise HTTPException(status_code=400, detail="Reservation end time must be after its start time")
+
+    total_price = (await fetch_rate_curve()).price(res_start, res_end)
+    if total_price is None:
+        quote_fallbacks += 1
+        total_price = await _request_quote(res_start, res_end)
+
+    return total_price
@@ -1,46 +1,143 @@
 from fastapi import HTTPException
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import asyncio
 import json
-from datetime import datetime, timedelta
+import math
+import os
+from datetime import datetime, timedelta, timezone
 
-from ..utils.db import reservations_collection, users_collection, spots_collection
+from ..utils.db import reservations_collection, users_collection, reservation_buckets_collection
 from .pricing_connector import fetch_pricing
+from .spots import fetch_spot
 from ..models.reservation import Reservation
-from ..utils.rabbit_connector import publish_message
+from ..utils.outbox import insert_with_event, delete_with_event
+from ..utils.pagination import keyset_filter
+from ..utils.reservation_index import reservation_index, naive_utc
+
+EPOCH = datetime(1970, 1, 1)
+DUPLICATE_KEY_ERROR = 11000
+#Longest reservation accepted, it bounds the buckets claimed by a booking
+MAX_BOOKING_MINUTES = int(os.getenv("MAX_BOOKING_MINUTES", "10080"))
+#Length of the spot time buckets that reservations claim
+RESERVATION_BUCKET_MINUTES = 60
+#Two bookings creating the same bucket at once can collide without overlapping, the claim is retried once
+CLAIM_ATTEMPTS = 2
 
 
 #=============================================================
 #   Utility functions used in main CRUD operations
 #=============================================================
 
-async def find_conflict(reservation_data: dict) -> dict | None:
-    """Checks the reservations collection for an existing reservation that has a time
-    conflict with the reservation trying to be created for a matching `spot_id`
+def bucket_claims(reservation_id: ObjectId, spot_id: ObjectId, start_time: datetime, end_time: datetime) -> list[UpdateOne]:
+    """Builds one claim per `RESERVATION_BUCKET_MINUTES` bucket of the spot that the reservation
+    touches. A claim adds the reservation to the bucket's holders only if no holder overlaps its
+    exact times. Otherwise the upsert tries to insert a second document for the bucket, which the
+    unique (spot_id, bucket) index rejects. Buckets expire a day after they have passed, well clear
+    of any timezone offset.
+    """
+    start_time, end_time = naive_utc(start_time), naive_utc(end_time)
+    first_bucket = math.floor((start_time - EPOCH).total_seconds() / 60 / RESERVATION_BUCKET_MINUTES)
+    last_bucket = math.ceil((end_time - EPOCH).total_seconds() / 60 / RESERVATION_BUCKET_MINUTES)
+    holder = {"reservation_id": reservation_id, "start_time": start_time, "end_time": end_time}
+    
+    return [
+        UpdateOne(
+            {
+                "spot_id": spot_id,
+                "bucket": bucket,
+                "holders": {"$not": {"$elemMatch": {"start_time": {"$lt": end_time}, "end_time": {"$gt": start_time}}}}
+            },
+            {
+                "$push": {"holders": holder},
+                "$setOnInsert": {"expires_at": EPOCH + timedelta(minutes=(bucket + 1) * RESERVATION_BUCKET_MINUTES, days=1)}
+            },
+            upsert=True
+        )
+        for bucket in range(first_bucket, last_bucket)
+    ]
 
-    Args:
-        reservation_data (dict): The reservation object data
+
+async def claim_slots(reservation_id: ObjectId, spot_id: ObjectId, start_time: datetime, end_time: datetime) -> bool:
+    """Atomically claims every bucket of the spot touched by the reservation. A bucket rejects
+    a reservation that overlaps one of its holders, so two overlapping bookings can never both
+    succeed, however they interleave, while back to back bookings share a bucket.
 
     Returns:
-        dict | None: The conflicting document from the reservations collection if one exists.
-        Otherwise returns `None`
+        bool: `True` if every bucket was claimed. `False` if a conflicting reservation holds
+        one of them, in which case any buckets claimed by this call are released again.
     """
-    conflict = await reservations_collection.find_one({
-        "spot_id": ObjectId(reservation_data["spot_id"]),
-        "start_time": {"$lt": reservation_data["end_time"]},
-        "end_time":   {"$gt": reservation_data["start_time"]}
-    })
+    for _ in range(CLAIM_ATTEMPTS):
+        try:
+            await reservation_buckets_collection.bulk_write(bucket_claims(reservation_id, spot_id, start_time, end_time), ordered=True)
+            return True
+        except BulkWriteError as e:
+            await release_slots(reservation_id)
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]):
+                raise
+    return False
+
+
+async def release_slots(reservation_id: ObjectId) -> None:
+    """Releases every bucket claimed by the reservation with mongo id `reservation_id`"""
+    await reservation_buckets_collection.update_many(
+        {"holders.reservation_id": reservation_id},
+        {"$pull": {"holders": {"reservation_id": reservation_id}}}
+    )
+
+
+async def backfill_reservation_slots() -> None:
+    """Claims the buckets of upcoming reservations made before bucket claims existed"""
+    cursor = reservations_collection.find({"end_time": {"$gt": naive_utc(datetime.now(timezone.utc))}, "buckets_claimed": {"$ne": True}})
+    backfilled = 0
+    async for reservation in cursor:
+        try:
+            await reservation_buckets_collection.bulk_write(
+                bucket_claims(reservation["_id"], reservation["spot_id"], reservation["start_time"], reservation["end_time"]),
+                ordered=False
+            )
+        except BulkWriteError:
+            #Overlapping legacy reservations keep whichever claim landed first
+            pass
+        await reservations_collection.update_one({"_id": reservation["_id"]}, {"$set": {"buckets_claimed": True}})
+        backfilled += 1
     
-    return conflict
+    if backfilled:
+        print(f"Claimed reservation slots for {backfilled} existing reservations")
+
+
+async def load_reservation_index() -> None:
+    """Loads every reservation that has not ended yet into the in-process reservation index"""
+    reservation_index.clear()
+    cursor = reservations_collection.find(
+        {"end_time": {"$gt": naive_utc(datetime.now(timezone.utc))}},
+        {"spot_id": 1, "start_time": 1, "end_time": 1}
+    )
+    async for reservation in cursor:
+        reservation_index.add(reservation["spot_id"], reservation["start_time"], reservation["end_time"])
+    reservation_index.loaded = True
+    print(f"Loaded {len(reservation_index)} upcoming reservations into the reservation index")
 
 
 #=============================================================
 #   Main CRUD operations
 #=============================================================
 
-async def fetch_all_reservations(filters: dict = {}) -> list:
-    """Returns a list of dict reservation objects from the reservations collection in database
+def find_reservations(filters: dict = {}, after: str | None = None, limit: int | None = None):
+    """Returns a Motor cursor over the reservations matching `filters`, in `_id` order,
+    starting after the reservation with mongo id `after`"""
+    cursor = reservations_collection.find(keyset_filter(filters, after)).sort("_id", 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+async def fetch_all_reservations(filters: dict = {}, after: str | None = None, limit: int | None = None) -> list:
+    """Returns a list of dict reservation objects from the reservations collection in database.
+    When `limit` is omitted every matching reservation is returned.
     """
-    reservations = await reservations_collection.find(filters).to_list(1000)
+    reservations = await find_reservations(filters, after, limit).to_list(None)
     return reservations
 
 
@@ -55,6 +152,8 @@ async def fetch_reservation(id: str) -> dict | None:
 async def create_reservation(reservation_data: dict) -> dict:
     """Inserts a reservation record into the db. This function checks to see whether
     a conflict will occur between an existing reservation and the one trying to be created.
+    The spot buckets touched by the reservation are claimed before it is priced and inserted,
+    so concurrent bookings of the same slot cannot both pass the conflict check.
 
     Args:
         reservation_data (dict): the reservation object
@@ -67,13 +166,18 @@ async def create_reservation(reservation_data: dict) -> dict:
         dict: The created user object
     """
     
-    #validate user exists
-    found_user = await users_collection.find_one({"_id": ObjectId(reservation_data["user_id"])})
+    #Reject known conflicts from the in-process index before any round trip
+    if reservation_index.conflicts(reservation_data["spot_id"], reservation_data["start_time"], reservation_data["end_time"]):
+        raise HTTPException(status_code=400, detail="Conflict with existing reservation")
+    
+    #validate user and spot exist
+    found_user, found_spot = await asyncio.gather(
+        users_collection.find_one({"_id": ObjectId(reservation_data["user_id"])}),
+        fetch_spot(reservation_data["spot_id"])
+    )
     if found_user is None:
         raise HTTPException(status_code=400, detail=f"User with id {reservation_data["user_id"]} does not exist")
     
-    #Validate spot exists
-    found_spot = await spots_collection.find_one({"_id": ObjectId(reservation_data["spot_id"])}) 
     if found_spot is None:
         raise HTTPException(status_code=400, detail=f"Spot with id {reservation_data["spot_id"]} does not exist")
     
@@ -82,11 +186,46 @@ async def create_reservation(reservation_data: dict) -> dict:
     if start_time < (datetime.now() + timedelta(seconds=50)) and (found_spot["status"] == "occupied" or found_spot["status"] == "reserved"):
         raise HTTPException(status_code=400, detail=f"Cannot make a reservation within the next 50 seconds because spot {reservation_data["spot_id"]} is still occupied or has been reserved")
     
-    #First check if a reservation conflict exists
-    conflict = await find_conflict(reservation_data)
-    if conflict is not None:
+    #Claiming the buckets is the authoritative conflict check and reserves them in one step
+    reservation_id = ObjectId()
+    spot_id = ObjectId(reservation_data["spot_id"])
+    if not await claim_slots(reservation_id, spot_id, reservation_data["start_time"], reservation_data["end_time"]):
         raise HTTPException(status_code=400, detail="Conflict with existing reservation")
     
+    try:
+        created_reservation = await insert_reservation(reservation_id, reservation_data)
+    except BaseException:
+        await release_slots(reservation_id)
+        raise
+    
+    reservation_index.add(created_reservation["spot_id"], created_reservation["start_time"], created_reservation["end_time"])
+    return created_reservation
+
+
+def simulator_event(event: str, reservation: dict) -> tuple[str, str]:
+    """Builds the routing key and body of the message telling the spot's simulator that
+    the reservation was `created` or `cancelled`"""
+    routing_key = f"spot_{reservation["spot_id"]}"
+    sim_payload = {
+        "event": event,
+        "reservation_id": str(reservation["_id"]),
+        "start_time": reservation["start_time"],
+        "end_time": reservation["end_time"]
+    }
+    send = json.dumps(sim_payload, default=lambda obj: obj.isoformat() if isinstance(obj, datetime) else None)
+    return routing_key, send
+
+
+async def insert_reservation(reservation_id: ObjectId, reservation_data: dict) -> dict:
+    """Prices and inserts a reservation whose buckets have already been claimed.
+
+    Args:
+        reservation_id (ObjectId): The mongo id the buckets were claimed under
+        reservation_data (dict): the reservation object
+
+    Returns:
+        dict: The created reservation object
+    """
     #Fetch pricing from pricing microservice
     price = await fetch_pricing(reservation_data["start_time"], reservation_data["end_time"])
     
@@ -100,27 +239,16 @@ async def create_reservation(reservation_data: dict) -> dict:
     )
     
     payload = reservation.model_dump(by_alias=True, exclude=["id"])
+    payload["_id"] = reservation_id
+    payload["buckets_claimed"] = True
     
     #Now change back the id strings to ObjectId fields
     payload["user_id"] = ObjectId(payload["user_id"])
     payload["spot_id"] = ObjectId(payload["spot_id"])
     
-    routing_key = f"spot_{payload["spot_id"]}"
-    sim_payload = {
-        "start_time": payload["start_time"],
-        "end_time": payload["end_time"]
-    }
-    send = json.dumps(sim_payload, default=lambda obj: obj.isoformat() if isinstance(obj, datetime) else None)
-    # get_channel().basic_publish(
-    #     exchange=EXCHANGE,
-    #     routing_key=routing_key,
-    #     body=send,
-    #     properties=BasicProperties(delivery_mode=2)
-    # )
-    publish_message(routing_key, send)
-    
-    new_reservation = await reservations_collection.insert_one(payload)
-    created_reservation = await reservations_collection.find_one({"_id": new_reservation.inserted_id})
+    #The simulator notification is written with the reservation and relayed from the outbox
+    await insert_with_event(reservations_collection, payload, *simulator_event("created", payload))
+    created_reservation = await reservations_collection.find_one({"_id": reservation_id})
     return created_reservation
 
 
@@ -134,7 +262,13 @@ async def remove_reservation(id: str) -> bool:
     Returns:
         bool: `True` if the delete was successful. `False` otherwise.
     """
-    result = await reservations_collection.delete_one({"_id": ObjectId(id)})
-    if result.deleted_count == 1:
+    deleted = await delete_with_event(
+        reservations_collection,
+        {"_id": ObjectId(id)},
+        lambda reservation: simulator_event("cancelled", reservation)
+    )
+    if deleted is not None:
+        await release_slots(deleted["_id"])
+        reservation_index.remove(deleted["spot_id"], deleted["start_time"], deleted["end_time"])
         return True
     return False
\ No newline at end of file
@@ -1,24 +1,117 @@
 from fastapi import HTTPException
 from bson import ObjectId
 from pymongo.errors import DuplicateKeyError
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
+from datetime import datetime, timezone
 
 from ..utils.db import spots_collection
+from ..utils.pagination import keyset_filter
+from ..utils.spot_events import publish_spot_change
+from ..utils.reservation_index import naive_utc
+from ..utils.spot_cache import spot_cache
 
+#Status updates written, and those discarded because the spot already had a newer observation
+applied_status_updates = 0
+discarded_status_updates = 0
 
-async def fetch_all_spots(filters: dict = {}) -> list:
-    """Returns a list of dict `ParkingSpot` objects from the parking spots collection in database
+
+def status_update_stats() -> dict:
+    return {
+        "applied": applied_status_updates,
+        "discarded": discarded_status_updates
+    }
+
+
+def observation_time(observed_at: datetime | None) -> datetime:
+    """Normalises an `observed_at` to how Mongo stores it (naive UTC, millisecond precision), so a
+    redelivered update compares equal to the stored one. Defaults to now."""
+    observed_at = naive_utc(observed_at or datetime.now(timezone.utc))
+    return observed_at.replace(microsecond=observed_at.microsecond // 1000 * 1000)
+
+
+def newer_than(observed_at: datetime) -> dict:
+    """Filter matching spots whose current status was observed before `observed_at`"""
+    return {"$or": [{"observed_at": {"$lt": observed_at}}, {"observed_at": {"$exists": False}}]}
+
+
+def find_spots(filters: dict = {}, after: str | None = None, limit: int | None = None):
+    """Returns a Motor cursor over the parking spots matching `filters`, in `_id` order,
+    starting after the spot with mongo id `after`"""
+    cursor = spots_collection.find(keyset_filter(filters, after)).sort("_id", 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+async def iterate_spots(filters: dict = {}, after: str | None = None, limit: int | None = None):
+    """Yields the matching parking spots like `find_spots`, from the spot cache when it is loaded"""
+    if spot_cache.ready:
+        for spot in spot_cache.find(filters, after, limit):
+            yield spot
+        return
+    async for spot in find_spots(filters, after, limit):
+        yield spot
+
+
+def spots_etag(filters: dict = {}, after: str | None = None, limit: int | None = None, stream: bool = False) -> str | None:
+    """The ETag of the spot list matching the query, or None while the spot cache is not loaded"""
+    return spot_cache.etag({
+        "filters": filters,
+        "after": str(ObjectId(after)) if after is not None else None,
+        "limit": limit,
+        "stream": stream
+    })
+
+
+async def fetch_all_spots(filters: dict = {}, after: str | None = None, limit: int | None = None) -> list:
+    """Returns a list of dict `ParkingSpot` objects, from the spot cache when it is loaded and
+    from the parking spots collection in database otherwise.
+    When `limit` is omitted every matching spot is returned.
     """
+    if spot_cache.ready:
+        return spot_cache.find(filters, after, limit)
 
-    spots = await spots_collection.find(filters).to_list(1000)
+    spots = await find_spots(filters, after, limit).to_list(None)
     return spots
 
 
+async def fetch_spot_stats() -> dict:
+    """Counts the parking spots by status, for the whole garage and per floor, with a single
+    aggregation instead of transferring the spot documents.
+
+    Returns:
+        dict: A dict matching the `ParkingSpotStats` model
+    """
+    groups = await spots_collection.aggregate([
+        {"$group": {"_id": {"floor_level": "$floor_level", "status": "$status"}, "count": {"$sum": 1}}}
+    ]).to_list(None)
+    
+    stats = {"total": 0, "occupied": 0, "reserved": 0, "vacant": 0}
+    floors = {}
+    for group in groups:
+        floor_level, status = group["_id"]["floor_level"], group["_id"]["status"]
+        floor = floors.setdefault(floor_level, {"floor_level": floor_level, "total": 0, "occupied": 0, "reserved": 0, "vacant": 0})
+        floor["total"] += group["count"]
+        stats["total"] += group["count"]
+        if status in stats:
+            floor[status] += group["count"]
+            stats[status] += group["count"]
+    
+    stats["floors"] = [floors[floor_level] for floor_level in sorted(floors)]
+    return stats
+
+
 async def fetch_spot(id: str) -> dict | None:
-    """Returns a dict of a single `ParkingSpot` object from the parking spots
-    collection in db with mongo id `id`"""
+    """Returns a dict of a single `ParkingSpot` object with mongo id `id`, from the spot cache
+    or, for a spot the cache does not hold (yet), from the parking spots collection in db"""
+    
+    cached_spot = spot_cache.get(str(ObjectId(id))) if spot_cache.ready else None
+    if cached_spot is not None:
+        return cached_spot
     
     spots = await spots_collection.find_one({"_id": ObjectId(id)})
+    if spots is not None and spot_cache.ready:
+        spot_cache.put(spots)
     return spots
 
 
@@ -40,13 +133,15 @@ async def create_spot(spot_data: dict) -> dict:
         raise HTTPException(400, detail="A spot with the provided combination of floor_level and spot_number already exists")
     
     created_spot = await spots_collection.find_one({"_id": new_spot.inserted_id})
+    spot_cache.put(created_spot)
+    publish_spot_change(None, created_spot)
     return created_spot
 
 
 async def update_spot(id: str, data: dict) -> dict:
     """Updates a document in the parking spots collection in db with matching mongo id `id` and
-    returns the updated spot. If no update parameters were passed, the current spot document
-    is returned.
+    returns the updated spot. If no update parameters were passed, or the status was observed
+    before the spot's current one (last write wins), the current spot document is returned.
 
     Args:
         id (str): Mongo object id
@@ -58,17 +153,38 @@ async def update_spot(id: str, data: dict) -> dict:
     Returns:
         dict: Returns the updated spot dict
     """
+    global applied_status_updates, discarded_status_updates
+    
+    filters = {"_id": ObjectId(id)}
+    observed_at = data.pop("observed_at", None)
+    if "status" in data:
+        data["observed_at"] = observation_time(observed_at)
+        filters.update(newer_than(data["observed_at"]))
+    
     if len(data) >= 1:
         
         try:
-            update_result = await spots_collection.find_one_and_update(
-                {"_id": ObjectId(id)},
+            #The previous version is needed for the status change event, $set makes the new one easy to derive
+            previous_spot = await spots_collection.find_one_and_update(
+                filters,
                 {"$set": data},
-                return_document=ReturnDocument.AFTER
+                return_document=ReturnDocument.BEFORE
             )
         except DuplicateKeyError:
             raise HTTPException(400, detail="A spot with the provided combination of floor_level and spot_number already exists")
-            
+        
+        if previous_spot is None:
+            #Either the spot does not exist or the update is stale, which leaves the spot as it is
+            existing_spot = await spots_collection.find_one({"_id": ObjectId(id)})
+            if existing_spot is not None:
+                discarded_status_updates += 1
+            return existing_spot
+        
+        if "status" in data:
+            applied_status_updates += 1
+        update_result = {**previous_spot, **data}
+        spot_cache.put(update_result)
+        publish_spot_change(previous_spot, update_result)
         return update_result
     
     #Update is empty, but still return the matching document
@@ -76,6 +192,107 @@ async def update_spot(id: str, data: dict) -> dict:
     return existing_spot
 
 
+SPOT_STATUSES = ("vacant", "occupied", "reserved")
+
+
+async def update_spot_statuses(updates: list[dict]) -> list[dict]:
+    """Applies a batch of sensor status updates with a single bulk write. The update observed
+    last wins: one observed before the spot's current status, or before another update of the
+    same spot in the batch, is reported as stale and skipped. Status change events are published
+    only for the updates actually written.
+
+    Args:
+        updates (list[dict]): `SpotStatusUpdate` dicts with `spot_id`, `status` and `observed_at`
+
+    Returns:
+        list[dict]: A `SpotStatusResult` dict per update, in the same order
+    """
+    global applied_status_updates, discarded_status_updates
+    results = []
+    valid = []
+    for update in updates:
+        if not ObjectId.is_valid(update["spot_id"]):
+            results.append({"spot_id": update["spot_id"], "result": "invalid", "detail": "Invalid spot id"})
+        elif update["status"] not in SPOT_STATUSES:
+            results.append({"spot_id": update["spot_id"], "result": "invalid", "detail": f"Invalid status '{update["status"]}'"})
+        else:
+            results.append(None)
+            valid.append((len(results) - 1, update))
+
+    #The current versions find the missing spots and give the status change events their previous status
+    ids = list({ObjectId(update["spot_id"]) for _, update in valid})
+    current = {
+        str(spot["_id"]): spot
+        async for spot in spots_collection.find({"_id": {"$in": ids}}, {"floor_level": 1, "spot_number": 1, "status": 1, "observed_at": 1})
+    }
+
+    #Only the newest update of each spot in the batch is written, it supersedes the others
+    newest = {}
+    received_at = datetime.now(timezone.utc)
+    stale = 0
+    for i, update in valid:
+        spot = current.get(update["spot_id"])
+        if spot is None:
+            results[i] = {"spot_id": update["spot_id"], "result": "not_found", "detail": f"Parking spot with id {update["spot_id"]} not found"}
+            continue
+
+        observed_at = observation_time(update.get("observed_at") or received_at)
+        if spot.get("observed_at") is not None and spot["observed_at"] >= observed_at:
+            results[i] = {"spot_id": update["spot_id"], "result": "stale", "detail": f"The spot has a status observed at {spot["observed_at"].isoformat()}"}
+            stale += 1
+            continue
+
+        data = {"status": update["status"], "observed_at": observed_at}
+        previous = newest.get(update["spot_id"])
+        if previous is None or previous[1]["observed_at"] < observed_at:
+            newest[update["spot_id"]] = (i, data)
+        if previous is not None:
+            superseded = i if newest[update["spot_id"]][0] != i else previous[0]
+            results[superseded] = {"spot_id": update["spot_id"], "result": "stale", "detail": "A status of the spot observed later is in the same batch"}
+            stale += 1
+
+    discarded_status_updates += stale
+    if not newest:
+        return results
+
+    #The guard discards the update if a newer one was written since the spots were read
+    operations = [
+        UpdateOne({"_id": current[spot_id]["_id"], **newer_than(data["observed_at"])}, {"$set": data})
+        for spot_id, (_, data) in newest.items()
+    ]
+    write_result = await spots_collection.bulk_write(operations, ordered=True)
+    written = set(newest)
+    if write_result.matched_count < len(operations):
+        #Some spots were written or removed meanwhile. The bulk result does not say which, so the spots
+        #are read again: those holding a status observed at another time were not written by this batch
+        stored = {
+            str(spot["_id"]): spot.get("observed_at")
+            async for spot in spots_collection.find({"_id": {"$in": [current[spot_id]["_id"] for spot_id in newest]}}, {"observed_at": 1})
+        }
+        for spot_id, (i, data) in newest.items():
+            if spot_id not in stored:
+                written.discard(spot_id)
+                results[i] = {"spot_id": spot_id, "result": "not_found", "detail": f"Parking spot with id {spot_id} not found"}
+            elif stored[spot_id] != data["observed_at"]:
+                written.discard(spot_id)
+                results[i] = {"spot_id": spot_id, "result": "stale", "detail": f"The spot has a status observed at {stored[spot_id].isoformat()}"}
+
+    applied_status_updates += len(written)
+    discarded_status_updates += len(newest) - len(written)
+    for spot_id in written:
+        i, data = newest[spot_id]
+        results[i] = {"spot_id": spot_id, "result": "applied"}
+        before = current[spot_id]
+        after = {**before, **data}
+        #Only the written fields are known here, the cached spot is updated with them
+        cached_spot = spot_cache.get(spot_id)
+        if cached_spot is not None:
+            spot_cache.put({**cached_spot, **data})
+        publish_spot_change(before, after)
+
+    return results
+
+
 async def remove_spot(id: str) -> bool:
     """Deletes a spot with the mongo id `id` from the spots collection.
 
@@ -85,7 +302,9 @@ async def remove_spot(id: str) -> bool:
     Returns:
         bool: `True` if the delete was successful. `False` otherwise.
     """
-    result = await spots_collection.delete_one({"_id": ObjectId(id)})
-    if result.deleted_count == 1:
+    deleted_spot = await spots_collection.find_one_and_delete({"_id": ObjectId(id)})
+    if deleted_spot is not None:
+        spot_cache.remove(str(ObjectId(id)))
+        publish_spot_change(deleted_spot, None)
         return True
     return False
\ No newline at end of file
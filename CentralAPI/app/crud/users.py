@@ -4,16 +4,27 @@ from bson import ObjectId
 from pymongo.errors import DuplicateKeyError
 from pymongo import ReturnDocument
 
-from ..utils.auth import get_password_hash, create_access_token
+from ..utils.auth import get_password_hash, create_access_token, user_cache
 from ..utils.db import users_collection
+from ..utils.pagination import keyset_filter
 from ..models.user import Token
 
-async def fetch_all_users(filters: dict = {}) -> list:
+def find_users(filters: dict = {}, after: str | None = None, limit: int | None = None):
+    """Returns a Motor cursor over the users matching `filters`, in `_id` order,
+    starting after the user with mongo id `after`"""
+    cursor = users_collection.find(keyset_filter(filters, after)).sort("_id", 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+async def fetch_all_users(filters: dict = {}, after: str | None = None, limit: int | None = None) -> list:
     """Returns a list of dict user objects from the users collection in database
     Filters have not been documented yet but are functional if you know how to use it.
+    When `limit` is omitted every matching user is returned.
     """
 
-    users = await users_collection.find(filters).to_list(1000)
+    users = await find_users(filters, after, limit).to_list(None)
     return users
 
 
@@ -37,10 +48,8 @@ async def create_user(user_data: dict) -> dict:
     Returns:
         dict: The created user sign up object
     """
-    #Get an access token
-    token = create_access_token(username=user_data["username"])
     try:
-        user_data["password"] = get_password_hash(user_data["password"])
+        user_data["password"] = await get_password_hash(user_data["password"])
         new_user = await users_collection.insert_one(user_data)
     except DuplicateKeyError:
         raise HTTPException(status_code=400, detail=f"A user with the provided username or email already exists")
@@ -49,6 +58,8 @@ async def create_user(user_data: dict) -> dict:
     if created_user is None:
         raise HTTPException(status_code=500, detail="User creation failed")
     
+    #Get an access token, it carries the new user's id
+    token = create_access_token(username=created_user["username"], user_id=str(created_user["_id"]))
     created_user["token"] = Token(access_token=token, token_type="bearer")
     return created_user
 
@@ -66,7 +77,7 @@ async def update_user(id: str, data: dict) -> dict | JSONResponse:
         dict | JSONResponse: Returns the updated user dict or a JSONResponse when a DuplicateKeyError arises
     """
     if "password" in data:
-        data["password"] = get_password_hash(data["password"])
+        data["password"] = await get_password_hash(data["password"])
     
     if len(data) >= 1:
         
@@ -76,6 +87,7 @@ async def update_user(id: str, data: dict) -> dict | JSONResponse:
                 {"$set": data},
                 return_document=ReturnDocument.AFTER
             )
+            user_cache.invalidate(str(ObjectId(id)))
         except DuplicateKeyError:
             return JSONResponse(
                 status_code=400,
@@ -102,6 +114,7 @@ async def remove_user(id: str) -> bool:
         bool: `True` if the delete was successful. `False` otherwise.
     """
     result = await users_collection.delete_one({"_id": ObjectId(id)})
+    user_cache.invalidate(str(ObjectId(id)))
     if result.deleted_count == 1:
         return True
     return False
\ No newline at end of file
@@ -2,9 +2,15 @@
 # dotenv.load_dotenv()
 
 from fastapi import FastAPI
-from .utils.db import create_indexes, close_mongo_connection
+from .utils.db import create_indexes, explain_hot_queries, close_mongo_connection
 from .utils.rabbit_connector import init_rabbit, teardown_rabbit
-from .routers import users, authentication, reservations, spots
+from .utils.outbox import outbox_relay
+from .utils.sensor_consumer import sensor_consumer
+from .routers import users, authentication, reservations, spots, metrics
+from .crud.reservations import load_reservation_index, backfill_reservation_slots
+from .crud.pricing_connector import init_pricing_client, close_pricing_client
+from .utils.auth import password_hasher
+from .utils.spot_cache import spot_cache
 
 #============================================================
 #   Metadata/Constants
@@ -32,12 +38,24 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_db_client():
     await create_indexes()
-    init_rabbit()
+    await explain_hot_queries()
+    await spot_cache.start()
+    await backfill_reservation_slots()
+    await load_reservation_index()
+    await init_rabbit()
+    outbox_relay.start()
+    sensor_consumer.start()
+    init_pricing_client()
     
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await close_pricing_client()
+    await sensor_consumer.stop()
+    await spot_cache.stop()
+    await outbox_relay.stop()
+    await teardown_rabbit()
     await close_mongo_connection()
-    teardown_rabbit()
+    password_hasher.shutdown()
 
 #============================================================
 #   Register the routes
@@ -47,6 +65,7 @@ app.include_router(users.router)
 app.include_router(spots.router)
 app.include_router(reservations.router)
 app.include_router(authentication.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
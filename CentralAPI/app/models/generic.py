@@ -1,9 +1,10 @@
-from typing import List, TypeVar, Generic
+from typing import List, TypeVar, Generic, Optional
 from pydantic import BaseModel, computed_field
 T = TypeVar("T")
 
 class ListResponse(BaseModel, Generic[T]):
     records: List[T]
+    next_cursor: Optional[str] = None
 
     @computed_field
     @property
@@ -11,9 +12,17 @@ class ListResponse(BaseModel, Generic[T]):
         return len(self.records)
     
 
+class PageParams(BaseModel):
+    """Keyset pagination parameters shared by the list endpoints"""
+    limit: Optional[int] = None
+    after: Optional[str] = None
+    stream: bool = False
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
     
 class TokenData(BaseModel):
-    username: str | None = None
\ No newline at end of file
+    username: str | None = None
+    user_id: str | None = None
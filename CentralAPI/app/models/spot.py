@@ -2,6 +2,7 @@ from pydantic import BaseModel, Field
 from pydantic.functional_validators import BeforeValidator
 from typing import Optional, Annotated, List, Literal
 from bson import ObjectId
+from datetime import datetime
 
 PyObjectId = Annotated[str, BeforeValidator(str)]
 
@@ -20,8 +21,50 @@ class ParkingSpot(ParkingSpotBase):
         
 class ParkingSpotUpdate(BaseModel):
     status: Literal['vacant', 'occupied', 'reserved'] = Field(None, description="State of the spot. Can only be vacant, occupied, or reserved")
+    observed_at: Optional[datetime] = Field(default=None, description="When the status was observed. A status observed before the spot's current one is ignored. Defaults to the time it was received")
     
     
 class ParkingSpotCollection(BaseModel):
     spots: List[ParkingSpot]
-    
+
+
+class FloorOccupancy(BaseModel):
+    floor_level: int = Field(..., example=3)
+    total: int = Field(default=0, example=20)
+    occupied: int = Field(default=0, example=12)
+    reserved: int = Field(default=0, example=3)
+    vacant: int = Field(default=0, example=5)
+
+
+class ParkingSpotStats(BaseModel):
+    """Spot counts by status, for the whole garage and per floor"""
+    total: int = Field(default=0, example=60)
+    occupied: int = Field(default=0, example=31)
+    reserved: int = Field(default=0, example=6)
+    vacant: int = Field(default=0, example=23)
+    floors: List[FloorOccupancy] = Field(default=[])
+
+
+MAX_STATUS_BATCH_SIZE = 1000
+
+
+class SpotStatusUpdate(BaseModel):
+    spot_id: str = Field(..., example="67ccb6d6825b86fb6abcae70")
+    status: str = Field(..., example="occupied", description="State of the spot. Can only be vacant, occupied, or reserved. Other values are reported as invalid")
+    observed_at: Optional[datetime] = Field(default=None, example=datetime(2025, 3, 29, 18, 30, 0), description="When the sensor observed the status. Defaults to the time it was received")
+
+
+class SpotStatusBatch(BaseModel):
+    updates: List[SpotStatusUpdate] = Field(..., min_length=1, max_length=MAX_STATUS_BATCH_SIZE)
+
+
+class SpotStatusResult(BaseModel):
+    spot_id: str = Field(..., example="67ccb6d6825b86fb6abcae70")
+    result: Literal['applied', 'stale', 'not_found', 'invalid'] = Field(..., example="applied")
+    detail: Optional[str] = Field(default=None, example=None)
+
+
+class SpotStatusBatchResult(BaseModel):
+    """The outcome of each update, in the order they were sent"""
+    applied: int = Field(default=0, example=1)
+    results: List[SpotStatusResult] = Field(default=[])
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import Annotated
 from ..utils.auth import authenticate_user, create_access_token
+from ..utils.login_limiter import login_limiter
 from ..models.user import UserCreate, UserSignUp
 from..models.generic import Token
 from ..crud import users as user_crud
@@ -11,17 +12,23 @@ router = APIRouter(
     tags=["Authorization"]
 )
 
-@router.post("/login")
-async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
+@router.post("/login", responses={429: {"description": "Too many login attempts from this address or for this username"}})
+async def login_for_access_token(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
+    #Turned away before the user lookup and password hash
+    client_ip = request.client.host if request.client else "unknown"
+    attempted_at = await login_limiter.admit(form_data.username, client_ip)
+    
     user = await authenticate_user(form_data.username, form_data.password)
     if not user:
+        await login_limiter.record_failure(form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token = create_access_token(username=user["username"])
+    await login_limiter.record_success(form_data.username, client_ip, attempted_at)
+    access_token = create_access_token(username=user["username"], user_id=str(user["_id"]))
     return Token(access_token=access_token, token_type="bearer")
 
 
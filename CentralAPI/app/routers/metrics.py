@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+from ..utils.rabbit_connector import publisher
+from ..utils.outbox import outbox_relay
+from ..utils.sensor_consumer import sensor_consumer
+from ..utils.spot_stream import spot_stream
+from ..utils.spot_cache import spot_cache
+from ..utils.auth import user_cache, password_hasher
+from ..utils.login_limiter import login_limiter
+from ..crud.pricing_connector import pricing_stats
+from ..crud.spots import status_update_stats
+
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["Metrics"]
+)
+
+
+@router.get(
+    path="",
+    summary="Get service metrics",
+    description="Fetch runtime counters of the background components of the API, such as the RabbitMQ publisher buffer depth and confirm latency, the outbox backlog, the sensor event consumer, spot status updates applied and discarded as stale, the /spots/stream subscribers, the spot cache, the verified user cache, the password hashing pool, the login rate limiter, and the pricing connector cache and circuit breaker"
+)
+async def getMetrics() -> dict:
+    return {
+        "rabbit_publisher": publisher.stats(),
+        "outbox_relay": await outbox_relay.stats(),
+        "sensor_consumer": sensor_consumer.stats(),
+        "spot_status_updates": status_update_stats(),
+        "spot_stream": spot_stream.stats(),
+        "spot_cache": spot_cache.stats(),
+        "auth_cache": user_cache.stats(),
+        "password_hashing": password_hasher.stats(),
+        "login_limiter": login_limiter.stats(),
+        "pricing_connector": pricing_stats()
+    }
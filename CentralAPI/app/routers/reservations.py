@@ -2,9 +2,10 @@ from fastapi import APIRouter, HTTPException, Depends, status, Response
 from datetime import timedelta
 
 from ..models.reservation import Reservation, ReservationCreate
-from ..models.generic import ListResponse
+from ..models.generic import ListResponse, PageParams
 from ..crud import reservations as reservations_crud
 from ..utils.filtering import parse_reservations_filter
+from ..utils.pagination import parse_page_params, next_cursor, ndjson_response
 
 
 res_not_found_response = {
@@ -30,12 +31,14 @@ router = APIRouter(
 @router.get(
     path="",
     summary="Get all reservations",
-    description="Fetch a list of all reservations",
+    description="Fetch a list of all reservations. Use `limit` and `after` to page through the results, or `stream` to receive them as newline delimited JSON",
     response_model=ListResponse[Reservation]
 )
-async def getReservations(filters: dict = Depends(parse_reservations_filter)) -> ListResponse[Reservation]:
-    reservations = await reservations_crud.fetch_all_reservations(filters)
-    return ListResponse(records=reservations)
+async def getReservations(filters: dict = Depends(parse_reservations_filter), page: PageParams = Depends(parse_page_params)) -> ListResponse[Reservation]:
+    if page.stream:
+        return ndjson_response(reservations_crud.find_reservations(filters, page.after, page.limit), Reservation)
+    reservations = await reservations_crud.fetch_all_reservations(filters, page.after, page.limit)
+    return ListResponse(records=reservations, next_cursor=next_cursor(reservations, page.limit))
 
 
 @router.get(
@@ -55,13 +58,15 @@ async def getReservation(id: str) -> Reservation:
 @router.post(
     path="",
     summary="Create reservation",
-    description="Create a reservation record in the database. The start and end times must be in the future and the minimum booking time is 3 minutes",
+    description="Create a reservation record in the database. The start and end times must be in the future, the minimum booking time is 3 minutes and the maximum is `MAX_BOOKING_MINUTES` (a week by default)",
     response_model=Reservation,
     responses={404: {"detail": "Conflict with existing reservation"}}
 )
 async def createReservation(reservation: ReservationCreate) -> Reservation:
     if reservation.end_time < (reservation.start_time + timedelta(minutes=3)):
         raise HTTPException(status_code=400, detail="Minimum booking time is 3 minutes")
+    if reservation.end_time > (reservation.start_time + timedelta(minutes=reservations_crud.MAX_BOOKING_MINUTES)):
+        raise HTTPException(status_code=400, detail=f"Maximum booking time is {reservations_crud.MAX_BOOKING_MINUTES} minutes")
     created_reservation = await reservations_crud.create_reservation(reservation.model_dump(by_alias=True, exclude=["id"]))
     return created_reservation
 
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Response
-from ..models.spot import ParkingSpot, ParkingSpotBase, ParkingSpotUpdate
-from ..models.generic import ListResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, status, Response
+from fastapi.responses import StreamingResponse
+from ..models.spot import ParkingSpot, ParkingSpotBase, ParkingSpotUpdate, ParkingSpotStats, SpotStatusBatch, SpotStatusBatchResult
+from ..models.generic import ListResponse, PageParams
 from ..crud import spots as spots_crud
 from ..utils.filtering import parse_spots_filter
+from ..utils.pagination import parse_page_params, next_cursor, ndjson_response
+from ..utils.spot_stream import spot_stream, stream_spot_changes
 
 
 spot_not_found_response = {
@@ -28,12 +31,50 @@ router = APIRouter(
 @router.get(
     path="",
     summary="Get all parking spots",
-    description="Fetch a list of all parking spots",
-    response_model=ListResponse[ParkingSpot]
+    description="Fetch a list of all parking spots. Use `limit` and `after` to page through the results, or `stream` to receive them as newline delimited JSON. The response carries an `ETag` that changes with any change to any spot and differs between queries; send it back in `If-None-Match` to receive a 304 while nothing has changed",
+    response_model=ListResponse[ParkingSpot],
+    responses={304: {"description": "No spot has changed since the response with the given ETag"}}
 )
-async def getSpots(filters: dict = Depends(parse_spots_filter)) -> ListResponse[ParkingSpot]:
-    spots = await spots_crud.fetch_all_spots(filters)
-    return ListResponse(records=spots)
+async def getSpots(request: Request, response: Response, filters: dict = Depends(parse_spots_filter), page: PageParams = Depends(parse_page_params)) -> ListResponse[ParkingSpot]:
+    #The spots are served from the spot cache, its version identifies the state of every spot
+    etag = spots_crud.spots_etag(filters, page.after, page.limit, page.stream)
+    if etag is not None:
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+    if page.stream:
+        streaming_response = ndjson_response(spots_crud.iterate_spots(filters, page.after, page.limit), ParkingSpot)
+        if etag is not None:
+            streaming_response.headers["ETag"] = etag
+        return streaming_response
+    spots = await spots_crud.fetch_all_spots(filters, page.after, page.limit)
+    return ListResponse(records=spots, next_cursor=next_cursor(spots, page.limit))
+
+
+@router.get(
+    path="/stats",
+    summary="Get parking spot statistics",
+    description="Fetch the number of total, occupied, reserved and vacant spots for the whole garage and per floor",
+    response_model=ParkingSpotStats
+)
+async def getSpotStats() -> ParkingSpotStats:
+    stats = await spots_crud.fetch_spot_stats()
+    return stats
+
+
+@router.get(
+    path="/stream",
+    summary="Stream parking spot status changes",
+    description="Subscribe to spot status changes as Server-Sent Events. A `ready` event confirms the subscription, then every change is pushed as a `spot_status` event with the spot id, floor level, spot number, status and previous status (`null` for a created spot, and status `null` for a removed one). A client that falls behind receives a `resync` event and the stream ends, it should reload the spots from GET /spots and subscribe again",
+    response_class=StreamingResponse
+)
+async def streamSpotChanges() -> StreamingResponse:
+    return StreamingResponse(
+        stream_spot_changes(spot_stream),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get(
@@ -62,6 +103,20 @@ async def createSpot(reservation: ParkingSpotBase) -> ParkingSpot:
     return created_spot
 
 
+@router.put(
+    path="/status:batch",
+    summary="Update the status of many parking spots",
+    description="Apply a batch of sensor status updates in a single write. Each update is reported as applied, stale (the spot has a status observed later, or a later status of the spot is in the same batch), not_found or invalid, in the order they were sent. Status change events are published only for applied updates",
+    response_model=SpotStatusBatchResult
+)
+async def updateSpotStatuses(batch: SpotStatusBatch) -> SpotStatusBatchResult:
+    results = await spots_crud.update_spot_statuses([update.model_dump() for update in batch.updates])
+    return SpotStatusBatchResult(
+        applied=sum(1 for result in results if result["result"] == "applied"),
+        results=results
+    )
+
+
 @router.put(
     path="/{id}",
     summary="Update parking spot",
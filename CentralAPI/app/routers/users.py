@@ -1,7 +1,10 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Response
+from typing import Annotated
 from ..models.user import User, UserCreate, UserUpdate, UserFilterParams
-from ..models.generic import ListResponse
+from ..models.generic import ListResponse, PageParams, TokenData
 from ..crud import users as user_crud
+from ..utils.pagination import parse_page_params, next_cursor, ndjson_response
+from ..utils.auth import get_current_principal, credentials_exception
 
 
 user_not_found_response = {
@@ -17,6 +20,22 @@ user_not_found_response = {
     }
 }
 
+not_own_account_response = {
+    401: {"description": "Missing, invalid or expired bearer token"},
+    403: {"description": "The bearer token belongs to another user"}
+}
+
+
+def require_own_account(id: str, principal: TokenData) -> None:
+    """Users may only change or delete their own account. Compared against the token's user id, so
+    no user lookup is needed"""
+    #Tokens issued before the uid claim have to be renewed by logging in again
+    if principal.user_id is None:
+        raise credentials_exception
+    if principal.user_id != id.lower():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You can only modify your own account")
+
+
 router = APIRouter(
     prefix="/users",
     tags=["Users"]
@@ -25,13 +44,15 @@ router = APIRouter(
 @router.get(
     path="",
     summary="Get all users",
-    description="Fetch a list of all users",
+    description="Fetch a list of all users. Use `limit` and `after` to page through the results, or `stream` to receive them as newline delimited JSON",
     response_model=ListResponse[User]
 )
-async def getUsers(filter_params: UserFilterParams = Depends()) -> ListResponse[User]:
+async def getUsers(filter_params: UserFilterParams = Depends(), page: PageParams = Depends(parse_page_params)) -> ListResponse[User]:
     filter_dict = filter_params.model_dump(exclude_unset=True, exclude_none=True)
-    users = await user_crud.fetch_all_users(filter_dict)
-    return ListResponse(records=users)
+    if page.stream:
+        return ndjson_response(user_crud.find_users(filter_dict, page.after, page.limit), User)
+    users = await user_crud.fetch_all_users(filter_dict, page.after, page.limit)
+    return ListResponse(records=users, next_cursor=next_cursor(users, page.limit))
 
 
 @router.get("/{id}", summary="Get user", description="Fetch a user by their Mongo id", response_model=User, responses=user_not_found_response)
@@ -48,9 +69,10 @@ async def getUser(id: str):
 #     return new_user
 
 
-@router.put("/{id}", summary="Update user", description="Update a user by ID", response_model=User, responses=user_not_found_response)
-async def updateUser(id: str, user_data: UserUpdate):
+@router.put("/{id}", summary="Update user", description="Update a user by ID. Requires the user's own bearer token", response_model=User, responses={**user_not_found_response, **not_own_account_response})
+async def updateUser(id: str, user_data: UserUpdate, principal: Annotated[TokenData, Depends(get_current_principal)]):
     """Update a user by ID"""
+    require_own_account(id, principal)
     
     update_payload = user_data.model_dump(by_alias=True, exclude_none=True)
     
@@ -59,8 +81,9 @@ async def updateUser(id: str, user_data: UserUpdate):
         return updated_user
     raise HTTPException(status_code=404, detail=f"User with {id} not found")
 
-@router.delete("/{id}", summary="Delete user", description="Delete a user by Mongo ID", status_code=status.HTTP_204_NO_CONTENT, responses=user_not_found_response)
-async def deleteUser(id: str):
+@router.delete("/{id}", summary="Delete user", description="Delete a user by Mongo ID. Requires the user's own bearer token", status_code=status.HTTP_204_NO_CONTENT, responses={**user_not_found_response, **not_own_account_response})
+async def deleteUser(id: str, principal: Annotated[TokenData, Depends(get_current_principal)]):
+    require_own_account(id, principal)
     result = await user_crud.remove_user(id)
     if result:
         return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -3,7 +3,12 @@ from fastapi.security import OAuth2PasswordBearer
 from typing import Annotated
 import jwt
 from jwt.exceptions import InvalidTokenError
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from collections import OrderedDict
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 
@@ -17,16 +22,84 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRES_MINUTES = os.getenv("ACCESS_TOKEN_EXPIRES_MINUTES")
 
+#Verified users are kept for a short TTL so authenticated requests skip the users lookup
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+
+#Cost factor of new password hashes, existing hashes keep the cost they were created with
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+#bcrypt releases the GIL, so hashing threads run in parallel with the event loop and each other
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+#Hashing jobs allowed to wait for a free worker, beyond that requests are turned away with a 503
+PASSWORD_HASH_MAX_WAITING = int(os.getenv("PASSWORD_HASH_MAX_WAITING", "64"))
+
     
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a bounded thread pool instead of the event loop.
+    At most `workers` jobs run at once and `max_waiting` more may queue, so a login storm gets
+    fast 503s instead of an ever growing backlog."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_waiting: int = PASSWORD_HASH_MAX_WAITING):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(workers + max_waiting)
+
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+
+    async def _run(self, function, *args):
+        if self._slots.locked():
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        async with self._slots:
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_ms += (time.perf_counter() - started) * 1000
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": BCRYPT_ROUNDS,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.total_ms / self.completed, 2) if self.completed else None
+        }
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+password_hasher = PasswordHasher()
+
+
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 
 async def get_user(username: str):
@@ -40,13 +113,15 @@ async def authenticate_user(username: str, password: str) -> User:
     user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user["password"]):
+    if not await verify_password(password, user["password"]):
         return False
     return user
 
 
-def create_access_token(username: str, expires_delta: timedelta | None = None):
+def create_access_token(username: str, expires_delta: timedelta | None = None, user_id: str | None = None):
     data = {"sub": username}
+    if user_id is not None:
+        data["uid"] = user_id
     
     to_encode = data.copy()
     if expires_delta is not None:
@@ -58,26 +133,97 @@ def create_access_token(username: str, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> UserCreate:
-    
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+class UserCache:
+    """Bounded LRU of the users behind verified tokens, keyed by user id. Entries expire after
+    `ttl` seconds, and are dropped as soon as the user is updated or removed.
+
+    Every invalidation bumps `generation`. A lookup passes the generation it started at to `put`,
+    so a user document read before an update cannot be cached after the update invalidated it."""
+
+    def __init__(self, size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL_SECONDS):
+        self.size = size
+        self.ttl = ttl
+        self._users: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> dict | None:
+        entry = self._users.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            self._users.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
 
+    def put(self, user_id: str, user: dict, generation: int | None = None) -> None:
+        #Invalidations are rare, so a lookup that overlapped any of them is simply not cached
+        if generation is not None and generation != self.generation:
+            return
+        self._users[user_id] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        self.generation += 1
+        self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._users), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
+
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+def decode_access_token(token: str) -> TokenData:
+    """Verifies the token's signature and expiry and returns its claims
+
+    Raises:
+        HTTPException: 401 when the token is invalid, expired or has no subject
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_name: str = payload.get("sub")
-        if user_name is None:
-            raise credentials_exception
-        token_data = TokenData(user_name=user_name)
     except InvalidTokenError:
         raise credentials_exception
-    
+    if payload.get("sub") is None:
+        raise credentials_exception
+    return TokenData(username=payload["sub"], user_id=payload.get("uid"))
+
+
+async def get_current_principal(token: Annotated[str, Depends(oauth2_scheme)]) -> TokenData:
+    """Dependency for routes that only need to know who is calling. The user id and username come
+    from the token's claims, without a database lookup."""
+    return decode_access_token(token)
+
 
-    user = await get_user(username=token_data.user_name)
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> UserCreate:
+    """Dependency for routes that need the user document. Tokens with a `uid` claim are served
+    from the user cache. Older tokens without one are looked up by username every time."""
+    token_data = decode_access_token(token)
+    if token_data.user_id is None or not ObjectId.is_valid(token_data.user_id):
+        user = await get_user(username=token_data.username)
+        if user is None:
+            raise credentials_exception
+        return user
+
+    user = user_cache.get(token_data.user_id)
     if user is None:
+        generation = user_cache.generation
+        user = await users_collection.find_one({"_id": ObjectId(token_data.user_id)})
+        if user is None:
+            raise credentials_exception
+        user_cache.put(token_data.user_id, user, generation)
+    #A token issued before the user was renamed no longer identifies them
+    if user["username"] != token_data.username:
         raise credentials_exception
     return user
 
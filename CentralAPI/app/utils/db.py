@@ -1,5 +1,8 @@
 import os
 import motor.motor_asyncio
+from bson import ObjectId
+from datetime import datetime
+from pymongo import IndexModel, ASCENDING
 
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
@@ -10,13 +13,94 @@ database = client.get_database(DB_NAME)
 reservations_collection = database.get_collection("reservations")
 users_collection = database.get_collection("users")
 spots_collection = database.get_collection("parking_spots")
+reservation_buckets_collection = database.get_collection("reservation_buckets")
+outbox_collection = database.get_collection("outbox")
+login_attempts_collection = database.get_collection("login_attempts")
+
+
+#=============================================================
+#   Managed indexes
+#=============================================================
+
+MANAGED_INDEXES = [
+    (users_collection, [
+        IndexModel("username", unique=True, name="uname_unique"),
+        IndexModel("email", unique=True, name="email_unique")
+    ]),
+    (spots_collection, [
+        IndexModel([("floor_level", ASCENDING), ("spot_number", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("floor_level", ASCENDING)], name="status_floor")
+    ]),
+    (reservations_collection, [
+        #Backs reservation lookups by spot: equality on spot_id, then the time range
+        IndexModel([("spot_id", ASCENDING), ("start_time", ASCENDING), ("end_time", ASCENDING)], name="spot_time_window"),
+        #Backs the My Reservations page lookup by user
+        IndexModel([("user_id", ASCENDING), ("start_time", ASCENDING)], name="user_start_time")
+    ]),
+    (reservation_buckets_collection, [
+        #A spot bucket is a single document, this is what makes booking conflicts atomic
+        IndexModel([("spot_id", ASCENDING), ("bucket", ASCENDING)], unique=True, name="spot_bucket_unique"),
+        IndexModel("holders.reservation_id", name="holder_reservation_id"),
+        IndexModel("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+    ]),
+    (outbox_collection, [
+        #The relay drains events oldest first
+        IndexModel("created_at", name="created_at")
+    ]),
+    (login_attempts_collection, [
+        #Backs the login limiter's count of recent attempts per address or username
+        IndexModel([("key", ASCENDING), ("at", ASCENDING)], name="key_at"),
+        IndexModel("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+    ])
+]
+
+#Sample shapes of the queries that run on every booking or page load
+HOT_QUERIES = {
+    "upcoming reservations by spot": (reservations_collection, {
+        "spot_id": ObjectId(),
+        "start_time": {"$lt": datetime.now()},
+        "end_time": {"$gt": datetime.now()}
+    }),
+    "reservations by user": (reservations_collection, {"user_id": ObjectId()}),
+    "spots by status": (spots_collection, {"status": "occupied"})
+}
+
 
 async def create_indexes():
-    await users_collection.create_index("username", unique=True, name="uname_unique")
-    await users_collection.create_index("email", unique=True, name="email_unique")
-    await spots_collection.create_index([("floor_level", 1), ("spot_number", 1)], unique=True)
+    for collection, indexes in MANAGED_INDEXES:
+        await collection.create_indexes(indexes)
     print("Connected to database")
 
+
+def _plan_stages(plan: dict) -> list[str]:
+    """Flattens a winning plan tree into the list of its stage names"""
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages += _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def explain_hot_queries() -> None:
+    """Logs the winning query plan of each hot query so a missing index shows up as
+    a collection scan in the startup logs."""
+    for name, (collection, query) in HOT_QUERIES.items():
+        try:
+            explanation = await collection.find(query).explain()
+        except Exception as e:
+            print(f"Could not explain query plan for {name}: {e}")
+            continue
+
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning_plan.get("queryPlan", winning_plan))
+
+        if "COLLSCAN" in stages:
+            print(f"WARNING: {name} on {collection.name} is a collection scan ({' <- '.join(filter(None, stages))})")
+        else:
+            print(f"Query plan for {name} on {collection.name}: {' <- '.join(filter(None, stages))}")
+
+
 async def close_mongo_connection() -> None:
     client.close()
-    print("Disconnected from MongoDB database")
\ No newline at end of file
+    print("Disconnected from MongoDB database")
@@ -0,0 +1,169 @@
+"""Sliding window rate limiting of login attempts, per client IP and per username. Attempts are
+checked before the user lookup and the password hash, so a credential stuffing burst is turned away
+without any database or bcrypt work.
+
+Attempt times are kept in memory by default. Set `LOGIN_LIMITER_BACKEND=mongo` to share them
+between API instances through the `login_attempts` collection."""
+
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+
+from .db import login_attempts_collection
+
+LOGIN_LIMIT_WINDOW_SECONDS = float(os.getenv("LOGIN_LIMIT_WINDOW_SECONDS", "60"))
+#Only attempts in progress and failed attempts count towards an address, so one client serving many users is not capped by their successful logins
+LOGIN_LIMIT_PER_IP = int(os.getenv("LOGIN_LIMIT_PER_IP", "30"))
+#Only attempts in progress and failed attempts count towards a username either, a successful login clears them
+LOGIN_LIMIT_PER_USERNAME = int(os.getenv("LOGIN_LIMIT_PER_USERNAME", "5"))
+LOGIN_LIMITER_BACKEND = os.getenv("LOGIN_LIMITER_BACKEND", "memory")
+#Keys the in-memory store tracks before it forgets the least recently used
+LOGIN_LIMITER_MAX_KEYS = int(os.getenv("LOGIN_LIMITER_MAX_KEYS", "100000"))
+
+
+class MemoryAttemptStore:
+    """Attempt times per key in process memory, bounded to `max_keys` keys"""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = LOGIN_LIMITER_MAX_KEYS):
+        self.max_keys = max_keys
+        self._attempts: OrderedDict[str, deque[float]] = OrderedDict()
+
+    async def recent(self, key: str, since: float, limit: int) -> list[float]:
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return []
+        while attempts and attempts[0] <= since:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+        return list(attempts)[:limit]
+
+    async def add(self, key: str, at: float, window: float) -> None:
+        self._attempts.setdefault(key, deque()).append(at)
+        self._attempts.move_to_end(key)
+        while len(self._attempts) > self.max_keys:
+            self._attempts.popitem(last=False)
+
+    async def discard(self, key: str, at: float) -> None:
+        attempts = self._attempts.get(key)
+        if attempts is not None and at in attempts:
+            attempts.remove(at)
+
+    async def clear(self, key: str) -> None:
+        self._attempts.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._attempts)
+
+
+class MongoAttemptStore:
+    """Attempt times per key in the `login_attempts` collection, shared by every API instance.
+    A TTL index removes attempts once they leave the window."""
+
+    name = "mongo"
+
+    async def recent(self, key: str, since: float, limit: int) -> list[float]:
+        attempts = await login_attempts_collection.find(
+            {"key": key, "at": {"$gt": since}}, {"at": 1}
+        ).sort("at", 1).limit(limit).to_list(None)
+        return [attempt["at"] for attempt in attempts]
+
+    async def add(self, key: str, at: float, window: float) -> None:
+        await login_attempts_collection.insert_one({
+            "key": key,
+            "at": at,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=window)
+        })
+
+    async def discard(self, key: str, at: float) -> None:
+        await login_attempts_collection.delete_one({"key": key, "at": at})
+
+    async def clear(self, key: str) -> None:
+        await login_attempts_collection.delete_many({"key": key})
+
+    def size(self) -> int | None:
+        return None
+
+
+class LoginLimiter:
+    """Admits at most `per_ip` login attempts per address and `per_username` attempts per username
+    in any `window` seconds. An admitted attempt counts towards its address and username unless it
+    succeeds, so concurrent guesses are limited like sequential ones. Rejected attempts are not recorded, so a
+    client that keeps retrying is let through again as soon as its oldest attempt leaves the window."""
+
+    def __init__(self, store, window: float = LOGIN_LIMIT_WINDOW_SECONDS, per_ip: int = LOGIN_LIMIT_PER_IP, per_username: int = LOGIN_LIMIT_PER_USERNAME):
+        self.store = store
+        self.window = window
+        self.per_ip = per_ip
+        self.per_username = per_username
+
+        self.admitted = 0
+        self.rejected_ip = 0
+        self.rejected_username = 0
+        self.failures = 0
+
+    async def _reserve(self, key: str, limit: int, now: float) -> float | None:
+        """Records an attempt for `key` and returns None, or the seconds until `key` may make another
+        attempt when it is over `limit`. The attempt is recorded before the attempts are counted, so
+        concurrent attempts cannot all pass the check."""
+        await self.store.add(key, now, self.window)
+        attempts = await self.store.recent(key, now - self.window, limit + 1)
+        if len(attempts) <= limit:
+            return None
+        await self.store.discard(key, now)
+        return attempts[0] + self.window - now
+
+    async def admit(self, username: str, client_ip: str) -> float:
+        """Records a login attempt against the address and the username and returns the time it was
+        recorded at, or turns it away when either is over its limit.
+
+        Raises:
+            HTTPException: 429 with a Retry-After header when the attempt is over a limit
+        """
+        now = time.time()
+        reserved = []
+        for key, limit in ((f"ip:{client_ip}", self.per_ip), (f"user:{username}", self.per_username)):
+            retry_after = await self._reserve(key, limit, now)
+            if retry_after is not None:
+                for reserved_key in reserved:
+                    await self.store.discard(reserved_key, now)
+                if key.startswith("ip:"):
+                    self.rejected_ip += 1
+                else:
+                    self.rejected_username += 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many login attempts, try again later",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+                )
+            reserved.append(key)
+
+        self.admitted += 1
+        return now
+
+    async def record_failure(self, username: str) -> None:
+        #The attempt was counted towards the address and username when it was admitted
+        self.failures += 1
+
+    async def record_success(self, username: str, client_ip: str, at: float) -> None:
+        """Takes back the attempt admitted at `at` from the address and clears the username"""
+        await self.store.discard(f"ip:{client_ip}", at)
+        await self.store.clear(f"user:{username}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.store.name,
+            "admitted": self.admitted,
+            "rejected_ip": self.rejected_ip,
+            "rejected_username": self.rejected_username,
+            "failures": self.failures,
+            "tracked_keys": self.store.size()
+        }
+
+
+login_limiter = LoginLimiter(MongoAttemptStore() if LOGIN_LIMITER_BACKEND == "mongo" else MemoryAttemptStore())
@@ -0,0 +1,175 @@
+"""Transactional outbox for broker events. Events are written to the outbox collection in the
+same transaction as the document they describe, then relayed to the exchange off the request path."""
+
+import asyncio
+from datetime import datetime, timezone
+from pymongo.errors import OperationFailure
+
+from .db import client, outbox_collection
+from .rabbit_connector import publisher
+
+RELAY_BATCH_SIZE = 100
+RELAY_POLL_INTERVAL_SECONDS = 5
+ILLEGAL_OPERATION = 20
+
+transactions_supported = True
+
+
+def outbox_event(routing_key: str, body: str) -> dict:
+    return {
+        "routing_key": routing_key,
+        "body": body,
+        "created_at": datetime.now(timezone.utc)
+    }
+
+
+async def _write_with_event(write, event_for):
+    """Runs `write(session)` and stores the outbox event `event_for(result)` returns (if any)
+    in the same transaction. Falls back to two plain writes when the server does not support
+    transactions (a standalone development instance), in which case the event is written second.
+    """
+    global transactions_supported
+
+    if transactions_supported:
+        try:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    result = await write(session)
+                    event = event_for(result)
+                    if event is not None:
+                        await outbox_collection.insert_one(event, session=session)
+            if event is not None:
+                outbox_relay.notify()
+            return result
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION:
+                raise
+            transactions_supported = False
+            print("WARNING: MongoDB transactions are not supported by this server, outbox writes are not atomic")
+
+    result = await write(None)
+    event = event_for(result)
+    if event is not None:
+        await outbox_collection.insert_one(event)
+        outbox_relay.notify()
+    return result
+
+
+async def insert_with_event(collection, document: dict, routing_key: str, body: str) -> None:
+    """Inserts `document` into `collection` together with an outbox event, so the event exists
+    if and only if the document does."""
+    event = outbox_event(routing_key, body)
+    await _write_with_event(
+        lambda session: collection.insert_one(document, session=session),
+        lambda result: event
+    )
+
+
+async def delete_with_event(collection, filters: dict, event_for) -> dict | None:
+    """Deletes the first document matching `filters` together with an outbox event built from it.
+
+    Args:
+        collection: The collection to delete from
+        filters (dict): Mongo filter of the document to delete
+        event_for: Called with the deleted document, returns its `(routing_key, body)`
+
+    Returns:
+        dict | None: The deleted document, or None if nothing matched (no event is written)
+    """
+    return await _write_with_event(
+        lambda session: collection.find_one_and_delete(filters, session=session),
+        lambda deleted: outbox_event(*event_for(deleted)) if deleted is not None else None
+    )
+
+
+class OutboxRelay:
+    """Background task that drains the outbox to the exchange in batches. An event is only
+    removed from the outbox once the broker has confirmed it, so delivery is at least once."""
+
+    def __init__(self, batch_size: int = RELAY_BATCH_SIZE, poll_interval: float = RELAY_POLL_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+        self.relayed = 0
+        self.failed = 0
+
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+    def notify(self) -> None:
+        """Wakes the relay so a new event goes out without waiting for the next poll"""
+        self._wake.set()
+
+
+    async def stats(self) -> dict:
+        return {
+            "backlog": await outbox_collection.estimated_document_count(),
+            "relayed": self.relayed,
+            "failed": self.failed
+        }
+
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                while await self.drain() == self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Outbox relay error: {e}")
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def drain(self) -> int:
+        """Relays the oldest batch of events and deletes the ones the broker confirmed.
+
+        Returns:
+            int: The number of events read from the outbox
+        """
+        events = await outbox_collection.find().sort("created_at", 1).limit(self.batch_size).to_list(None)
+        if not events:
+            return 0
+
+        results = await asyncio.gather(
+            *(publisher.publish(event["routing_key"], event["body"]) for event in events),
+            return_exceptions=True
+        )
+
+        delivered = []
+        for event, result in zip(events, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+            else:
+                delivered.append(event["_id"])
+
+        if delivered:
+            await outbox_collection.delete_many({"_id": {"$in": delivered}})
+            self.relayed += len(delivered)
+        if len(delivered) < len(events):
+            #Leave the rest in the outbox until the next poll instead of spinning on a failing broker
+            return 0
+        return len(events)
+
+
+outbox_relay = OutboxRelay()
@@ -0,0 +1,70 @@
+from fastapi import Query, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import Optional, Type, AsyncIterator
+from bson import ObjectId
+from pydantic import BaseModel
+
+from ..models.generic import PageParams
+
+MAX_PAGE_SIZE = 1000
+
+
+def parse_page_params(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of records to return. Omit to return every matching record"),
+    after: Optional[str] = Query(None, description="The `next_cursor` value from the previous page"),
+    stream: bool = Query(False, description="Stream the records as newline delimited JSON instead of a single list response")
+) -> PageParams:
+    """
+    Dependency function that validates the keyset pagination query params.
+
+    Example usage:
+        GET /reservations?limit=100
+        GET /reservations?limit=100&after=67ccb6d6825b86fb6abcae70
+    Returns:
+        PageParams to pass through to the matching crud fetch function.
+    """
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid cursor '{after}'"
+        )
+    return PageParams(limit=limit, after=after, stream=stream)
+
+
+def keyset_filter(filters: dict, after: str | None) -> dict:
+    """Combines the given mongo filter with the keyset condition on `_id`. Records are
+    always returned in `_id` order so the last id of a page is the cursor of the next one.
+
+    Args:
+        filters (dict): The mongo filter built from the request filter params
+        after (str | None): The mongo id of the last record of the previous page
+
+    Returns:
+        dict: The mongo filter to pass to `collection.find()`
+    """
+    if after is None:
+        return filters
+    
+    cursor_filter = {"_id": {"$gt": ObjectId(after)}}
+    if not filters:
+        return cursor_filter
+    return {"$and": [filters, cursor_filter]}
+
+
+def next_cursor(records: list, limit: int | None) -> str | None:
+    """Returns the cursor for the page following `records`, or `None` when there is no next page"""
+    if limit is None or len(records) < limit:
+        return None
+    return str(records[-1]["_id"])
+
+
+async def _ndjson_lines(cursor, model: Type[BaseModel]) -> AsyncIterator[str]:
+    async for document in cursor:
+        yield model.model_validate(document).model_dump_json(by_alias=True) + "\n"
+
+
+def ndjson_response(cursor, model: Type[BaseModel]) -> StreamingResponse:
+    """Streams the documents of a Motor cursor as newline delimited JSON, one `model`
+    per line, without materialising the full result set in memory.
+    """
+    return StreamingResponse(_ndjson_lines(cursor, model), media_type="application/x-ndjson")
@@ -1,56 +1,228 @@
-import pika
+import aio_pika
+from aio_pika.exceptions import DeliveryError
+import asyncio
 import os
-
-channel = None
-connection = None
+import time
 
 RABBIT_HOST = os.getenv("RABBIT_HOST")
 EXCHANGE = os.getenv("EXCHANGE_NAME")
 
-def init_rabbit():
-    global channel, connection
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBIT_HOST, 5672))
-    channel = connection.channel()
-    
-    channel.exchange_declare(
-        exchange=EXCHANGE,
-        exchange_type="direct",
-        durable=True
-    )
-    print("Rabbit connected")
-    
-    
-def publish_message(routing_key: str, body):
-    channel = get_channel()
-    try:
-        channel.basic_publish(
-            exchange=EXCHANGE,
-            routing_key=routing_key,
-            body=body,
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-    except Exception as e:
-        print("Error sending message:", e)
-        teardown_rabbit()
-        init_rabbit()
+OUTBOUND_BUFFER_SIZE = int(os.getenv("RABBIT_BUFFER_SIZE", "10000"))
+PUBLISH_BATCH_SIZE = int(os.getenv("RABBIT_BATCH_SIZE", "100"))
+PUBLISH_TIMEOUT_SECONDS = 10
+MAX_RECONNECT_BACKOFF_SECONDS = 30
+
+
+class PublisherBufferFull(Exception):
+    """Raised when the outbound buffer is full and a message cannot be accepted"""
+
+
+class RabbitPublisher:
+    """Publishes messages to the exchange from a background task, so request handlers never
+    wait on the broker. Messages are held in a bounded outbound buffer and sent in batches
+    with publisher confirms. A batch that could not be sent is kept and retried after the
+    connection is re-established with exponential backoff.
+    """
+
+    def __init__(self, buffer_size: int = OUTBOUND_BUFFER_SIZE, batch_size: int = PUBLISH_BATCH_SIZE):
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+
+        self._queue: asyncio.Queue | None = None
+        self._batch: list = []
+        self._task: asyncio.Task | None = None
+        self._connection: aio_pika.abc.AbstractConnection | None = None
+        self._exchange: aio_pika.abc.AbstractExchange | None = None
+
+        self.connected = False
+        self.published = 0
+        self.nacked = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.last_confirm_latency_ms: float | None = None
+        self.avg_confirm_latency_ms: float | None = None
+
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.buffer_size)
+        self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self, timeout: float = 5) -> None:
+        """Gives the buffer up to `timeout` seconds to drain, then closes the connection"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Closing RabbitMQ publisher with {self._queue.qsize() + len(self._batch)} unsent messages")
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._close()
+
+
+    def publish(self, routing_key: str, body: str | bytes) -> asyncio.Future:
+        """Adds a message to the outbound buffer without waiting on the broker.
+
+        Returns:
+            asyncio.Future: Resolves once the broker confirms the message. Fails with
+            `PublisherBufferFull` when the buffer is full, or `DeliveryError` if the broker nacks it.
+        """
+        if self._queue is None:
+            raise RuntimeError("The RabbitMQ publisher has not been started")
+
+        future = asyncio.get_running_loop().create_future()
+        if isinstance(body, str):
+            body = body.encode()
         try:
-            channel.basic_publish(
-                exchange=EXCHANGE,
-                routing_key=routing_key,
-                body=body,
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
-        except Exception as e:
-            print("Error on second attempt.")
-    
-    
-def teardown_rabbit():
-    global channel, connection
-    if channel is not None and channel.is_open:
-        channel.close()
-        
-    if connection and connection.is_open:
-        connection.close()
-        
-def get_channel():
-    return channel
\ No newline at end of file
+            self._queue.put_nowait((routing_key, body, future))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            future.set_exception(PublisherBufferFull(f"Outbound buffer is full ({self.buffer_size} messages)"))
+        return future
+
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "buffer_depth": self._queue.qsize() if self._queue is not None else 0,
+            "buffer_size": self.buffer_size,
+            "in_flight": len(self._batch),
+            "published": self.published,
+            "nacked": self.nacked,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "last_confirm_latency_ms": self.last_confirm_latency_ms,
+            "avg_confirm_latency_ms": self.avg_confirm_latency_ms
+        }
+
+
+    async def _run(self) -> None:
+        backoff = 1
+        while True:
+            try:
+                await self._connect()
+                backoff = 1
+                while True:
+                    if not self._batch:
+                        await self._next_batch()
+                    await self._publish_batch()
+                    if self._batch:
+                        raise ConnectionError(f"{len(self._batch)} messages were not confirmed")
+            except asyncio.CancelledError:
+                self._fail_remaining()
+                raise
+            except Exception as e:
+                print(f"RabbitMQ publisher error: {e}. Reconnecting in {backoff}s")
+                await self._close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF_SECONDS)
+                self.reconnects += 1
+
+
+    async def _connect(self) -> None:
+        self._connection = await aio_pika.connect(host=RABBIT_HOST, port=5672)
+        channel = await self._connection.channel(publisher_confirms=True)
+        self._exchange = await channel.declare_exchange(EXCHANGE, aio_pika.ExchangeType.DIRECT, durable=True)
+        self.connected = True
+        print("Rabbit connected")
+
+
+    async def _close(self) -> None:
+        self.connected = False
+        if self._connection is not None and not self._connection.is_closed:
+            try:
+                await self._connection.close()
+            except Exception as e:
+                print(f"Error closing RabbitMQ connection: {e}")
+        self._connection = None
+        self._exchange = None
+
+
+    async def _next_batch(self) -> None:
+        """Waits for the next message, then takes whatever else is already buffered up to the batch size"""
+        self._batch.append(await self._queue.get())
+        while len(self._batch) < self.batch_size and not self._queue.empty():
+            self._batch.append(self._queue.get_nowait())
+
+
+    async def _publish_batch(self) -> None:
+        """Publishes the current batch with every confirm in flight at once. Confirmed and
+        nacked messages are resolved, anything else stays in the batch to be retried."""
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(
+                self._exchange.publish(
+                    aio_pika.Message(body=body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT),
+                    routing_key=routing_key,
+                    timeout=PUBLISH_TIMEOUT_SECONDS
+                )
+                for routing_key, body, _ in self._batch
+            ),
+            return_exceptions=True
+        )
+        self._record_latency((time.perf_counter() - started) * 1000)
+
+        unsent = []
+        for message, result in zip(self._batch, results):
+            future = message[2]
+            if isinstance(result, DeliveryError):
+                self.nacked += 1
+                if not future.done():
+                    future.set_exception(result)
+                self._queue.task_done()
+            elif isinstance(result, Exception):
+                unsent.append(message)
+            else:
+                self.published += 1
+                if not future.done():
+                    future.set_result(None)
+                self._queue.task_done()
+        self._batch = unsent
+
+
+    def _record_latency(self, latency_ms: float) -> None:
+        self.last_confirm_latency_ms = round(latency_ms, 3)
+        if self.avg_confirm_latency_ms is None:
+            self.avg_confirm_latency_ms = self.last_confirm_latency_ms
+        else:
+            self.avg_confirm_latency_ms = round(0.9 * self.avg_confirm_latency_ms + 0.1 * latency_ms, 3)
+
+
+    def _fail_remaining(self) -> None:
+        pending = self._batch
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, _, future in pending:
+            if not future.done():
+                future.set_exception(ConnectionError("The RabbitMQ publisher was stopped before the message was sent"))
+        self._batch = []
+
+
+publisher = RabbitPublisher()
+
+
+def _report_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        print("Error sending message:", future.exception())
+
+
+async def init_rabbit():
+    publisher.start()
+
+
+def publish_message(routing_key: str, body) -> asyncio.Future:
+    """Queues a message for the exchange and returns immediately. Failures are printed, callers
+    that need delivery guarantees can await the returned future."""
+    future = publisher.publish(routing_key, body)
+    future.add_done_callback(_report_failure)
+    return future
+
+
+async def teardown_rabbit():
+    await publisher.stop()
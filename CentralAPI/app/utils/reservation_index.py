@@ -0,0 +1,96 @@
+"""In-process index of upcoming reservations per spot, used to reject booking conflicts
+without a round trip to the database. The database stays the authoritative check at insert time."""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+
+def naive_utc(timestamp: datetime) -> datetime:
+    """Mongo hands back naive UTC datetimes, so aware datetimes are normalised to match"""
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+class SpotIntervals:
+    """The reservation intervals of a single spot. Reservations of a spot never overlap, so
+    keeping them sorted by start time also keeps them sorted by end time, and a conflict can
+    only come from the neighbours of the insertion point. Lookups are O(log n)."""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts: list[datetime] = []
+        self.ends: list[datetime] = []
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def overlaps(self, start: datetime, end: datetime) -> bool:
+        i = bisect_right(self.starts, start)
+        if i > 0 and self.ends[i - 1] > start:
+            return True
+        if i < len(self.starts) and self.starts[i] < end:
+            return True
+        return False
+
+    def add(self, start: datetime, end: datetime) -> None:
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+
+    def remove(self, start: datetime, end: datetime) -> bool:
+        i = bisect_left(self.starts, start)
+        while i < len(self.starts) and self.starts[i] == start:
+            if self.ends[i] == end:
+                del self.starts[i]
+                del self.ends[i]
+                return True
+            i += 1
+        return False
+
+    def prune(self, now: datetime) -> None:
+        """Drops every interval that ended before `now`"""
+        i = bisect_right(self.ends, now)
+        if i:
+            del self.starts[:i]
+            del self.ends[:i]
+
+
+class ReservationIndex:
+    """Maps `spot_id` to the `SpotIntervals` of its upcoming reservations.
+
+    The index only knows about bookings made through this process, so it assumes the API
+    runs as a single worker. A hit is treated as a conflict, a miss still goes to the database.
+    """
+
+    def __init__(self):
+        self._spots: dict[str, SpotIntervals] = {}
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return sum(len(intervals) for intervals in self._spots.values())
+
+    def conflicts(self, spot_id, start: datetime, end: datetime) -> bool:
+        intervals = self._spots.get(str(spot_id))
+        if intervals is None:
+            return False
+        return intervals.overlaps(naive_utc(start), naive_utc(end))
+
+    def add(self, spot_id, start: datetime, end: datetime) -> None:
+        intervals = self._spots.setdefault(str(spot_id), SpotIntervals())
+        intervals.prune(naive_utc(datetime.now(timezone.utc)))
+        intervals.add(naive_utc(start), naive_utc(end))
+
+    def remove(self, spot_id, start: datetime, end: datetime) -> bool:
+        intervals = self._spots.get(str(spot_id))
+        if intervals is None:
+            return False
+        return intervals.remove(naive_utc(start), naive_utc(end))
+
+    def clear(self) -> None:
+        self._spots.clear()
+        self.loaded = False
+
+
+reservation_index = ReservationIndex()
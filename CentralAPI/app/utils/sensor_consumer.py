@@ -0,0 +1,174 @@
+"""Consumer of the spot status updates sensors publish on the `sensor_events` queue. Updates are
+applied in micro-batches through the same bulk write as PUT /spots/status:batch, and a batch is
+only acknowledged once it is written, so the prefetch limit holds the broker back while the
+database catches up."""
+
+import aio_pika
+import asyncio
+import json
+import os
+from pydantic import ValidationError
+
+from ..models.spot import SpotStatusUpdate, MAX_STATUS_BATCH_SIZE
+from ..crud.spots import update_spot_statuses
+
+RABBIT_HOST = os.getenv("RABBIT_HOST")
+EXCHANGE = os.getenv("EXCHANGE_NAME")
+
+SENSOR_EVENTS_QUEUE = "sensor_events"
+#Unacknowledged messages the broker may have in flight to this consumer
+SENSOR_PREFETCH = int(os.getenv("SENSOR_PREFETCH", "1000"))
+SENSOR_BATCH_SIZE = int(os.getenv("SENSOR_BATCH_SIZE", "500"))
+#How long the first message of a batch waits for more before the batch is applied
+SENSOR_BATCH_WAIT_MS = int(os.getenv("SENSOR_BATCH_WAIT_MS", "50"))
+MAX_RECONNECT_BACKOFF_SECONDS = 30
+
+
+def parse_sensor_event(body: bytes) -> list[dict]:
+    """Decodes a message into its status updates. A message holds either a single update or
+    `{"updates": [...]}`.
+
+    Raises:
+        ValueError: When the message is not valid JSON or an update is malformed
+    """
+    event = json.loads(body)
+    updates = event["updates"] if isinstance(event, dict) and "updates" in event else [event]
+    try:
+        return [SpotStatusUpdate.model_validate(update).model_dump() for update in updates]
+    except ValidationError as e:
+        raise ValueError(str(e))
+
+
+class SensorConsumer:
+    """Collects messages from the `sensor_events` queue into batches of up to `batch_size`, or
+    whatever arrived within `batch_wait_ms` of the first, and applies each batch with one write"""
+
+    def __init__(self, prefetch: int = SENSOR_PREFETCH, batch_size: int = SENSOR_BATCH_SIZE, batch_wait_ms: int = SENSOR_BATCH_WAIT_MS):
+        self.prefetch = max(prefetch, batch_size)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+
+        self._messages: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._connection: aio_pika.abc.AbstractRobustConnection | None = None
+
+        self.connected = False
+        self.received = 0
+        self.applied = 0
+        self.rejected = 0
+        self.malformed = 0
+        self.failed_batches = 0
+        self.last_batch_size = 0
+
+
+    def start(self) -> None:
+        self._messages = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._subscribe()), asyncio.create_task(self._apply_batches())]
+
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._connection is not None and not self._connection.is_closed:
+            await self._connection.close()
+        self.connected = False
+
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "waiting": self._messages.qsize() if self._messages is not None else 0,
+            "received": self.received,
+            "applied": self.applied,
+            "rejected": self.rejected,
+            "malformed": self.malformed,
+            "failed_batches": self.failed_batches,
+            "last_batch_size": self.last_batch_size
+        }
+
+
+    async def _subscribe(self) -> None:
+        #connect_robust recovers dropped connections and consumers by itself, this loop only covers the first connect
+        backoff = 1
+        while True:
+            try:
+                self._connection = await aio_pika.connect_robust(host=RABBIT_HOST, port=5672)
+                channel = await self._connection.channel()
+                await channel.set_qos(prefetch_count=self.prefetch)
+                exchange = await channel.declare_exchange(EXCHANGE, aio_pika.ExchangeType.DIRECT, durable=True)
+                queue = await channel.declare_queue(SENSOR_EVENTS_QUEUE, durable=True)
+                await queue.bind(exchange, routing_key=SENSOR_EVENTS_QUEUE)
+                await queue.consume(self._messages.put)
+                self.connected = True
+                print("Consuming sensor events")
+                return
+            except Exception as e:
+                print(f"Could not subscribe to sensor events: {e}. Retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF_SECONDS)
+
+
+    async def _next_batch(self) -> list[aio_pika.abc.AbstractIncomingMessage]:
+        batch = [await self._messages.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._messages.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+
+    async def _apply_batches(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            self.received += len(batch)
+            self.last_batch_size = len(batch)
+
+            updates = []
+            for message in batch:
+                try:
+                    updates += parse_sensor_event(message.body)
+                except (ValueError, KeyError, TypeError) as e:
+                    #Redelivering a malformed message would not fix it, so it is acknowledged with the batch
+                    self.malformed += 1
+                    print(f"Ignoring malformed sensor event: {e}")
+
+            try:
+                results = []
+                for i in range(0, len(updates), MAX_STATUS_BATCH_SIZE):
+                    results += await update_spot_statuses(updates[i:i + MAX_STATUS_BATCH_SIZE])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed_batches += 1
+                print(f"Failed to apply {len(updates)} sensor updates, requeueing: {e}")
+                await self._settle(batch, requeue=True)
+                await asyncio.sleep(1)
+                continue
+
+            applied = sum(1 for result in results if result["result"] == "applied")
+            self.applied += applied
+            self.rejected += len(results) - applied
+            await self._settle(batch)
+
+
+    async def _settle(self, batch: list[aio_pika.abc.AbstractIncomingMessage], requeue: bool = False) -> None:
+        """Acknowledges (or requeues) every message of the batch with a single frame"""
+        last = batch[-1]
+        try:
+            if requeue:
+                await last.nack(multiple=True, requeue=True)
+            else:
+                await last.ack(multiple=True)
+        except Exception as e:
+            #Unacknowledged messages are redelivered after a reconnect, and reapplying a status is harmless
+            print(f"Could not settle sensor events: {e}")
+
+
+sensor_consumer = SensorConsumer()
@@ -0,0 +1,242 @@
+"""In-memory copy of every parking spot. The set of spots is small and bounded, so reads of
+GET /spots and spot lookups are served from a dict instead of Mongo.
+
+Writes made by this process update the cache directly. Writes made elsewhere (other API
+instances, manual edits) arrive through a change stream on the spots collection, which also
+rebuilds the cache after a restart. Change streams need a replica set; against a standalone
+server the cache is reloaded every `SPOT_CACHE_RELOAD_SECONDS` instead."""
+
+import asyncio
+import hashlib
+import json
+import operator
+import os
+import uuid
+from bisect import bisect_right
+from bson import ObjectId
+
+from .db import spots_collection
+
+SPOT_CACHE_RELOAD_SECONDS = float(os.getenv("SPOT_CACHE_RELOAD_SECONDS", "30"))
+#Backoff between attempts to reopen the change stream, doubled on every failure up to the maximum
+SPOT_CACHE_RESYNC_SECONDS = 1
+SPOT_CACHE_RESYNC_MAX_SECONDS = 30
+
+_operators = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le
+}
+
+
+def matches(spot: dict, filters: dict) -> bool:
+    """Evaluates a spots filter built by `parse_spots_filter` against a spot document"""
+    for field, conditions in filters.items():
+        for op, value in conditions.items():
+            if field not in spot:
+                if op != "$ne":
+                    return False
+                continue
+            try:
+                if not _operators[op](spot[field], value):
+                    return False
+            except TypeError:
+                #Mongo never matches values of different types
+                return False
+    return True
+
+
+class SpotCache:
+    """Spot documents keyed by their id. `version` changes with every change to any spot, and
+    with the startup `epoch` forms the ETag of the spot list.
+
+    The cache is only `ready` while it is loaded and, if it follows the change stream, while the
+    stream is open. Spots are read from Mongo in the meantime."""
+
+    def __init__(self):
+        self._spots: dict[str, dict] = {}
+        #Spot ids in `_id` order for keyset pagination, equal length hex strings sort like ObjectIds
+        self._order: list[str] | None = None
+        self._stream = None
+        self._task: asyncio.Task | None = None
+
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.ready = False
+        self.following = False
+        self.reloads = 0
+        self.changes_applied = 0
+
+
+    def etag(self, query: dict) -> str | None:
+        """The ETag of the spot list answering `query`, or None while the cache is not ready.
+        The query is hashed in, so responses to different filters or pages never share a tag."""
+        if not self.ready:
+            return None
+        digest = hashlib.sha1(json.dumps(query, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return f'"{self.epoch}-{self.version}-{digest}"'
+
+
+    async def start(self) -> None:
+        try:
+            self._stream = await self._open_and_load()
+            self.following = True
+        except Exception as e:
+            print(f"Spot change stream unavailable ({e}), reloading the spot cache every {SPOT_CACHE_RELOAD_SECONDS}s instead")
+            await self.load()
+        self._task = asyncio.create_task(self._follow() if self.following else self._reload_periodically())
+
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._close_stream()
+        self.following = False
+
+
+    async def load(self) -> None:
+        """Replaces the cache with every spot in the database"""
+        spots = await spots_collection.find({}).to_list(None)
+        self._spots = {str(spot["_id"]): spot for spot in spots}
+        self._order = None
+        self.version += 1
+        self.reloads += 1
+        self.ready = True
+
+
+    async def _open_and_load(self):
+        #The stream is opened before the spots are read, so no change falls between the two
+        stream = spots_collection.watch(full_document="updateLookup")
+        try:
+            first_change = await stream.try_next()
+            await self.load()
+            if first_change is not None:
+                self._apply(first_change)
+        except Exception:
+            await stream.close()
+            raise
+        return stream
+
+
+    async def _close_stream(self) -> None:
+        if self._stream is not None:
+            stream, self._stream = self._stream, None
+            try:
+                await stream.close()
+            except Exception as e:
+                print(f"Could not close the spot change stream: {e}")
+
+
+    async def _follow(self) -> None:
+        delay = SPOT_CACHE_RESYNC_SECONDS
+        while True:
+            if self._stream is None:
+                try:
+                    self._stream = await self._open_and_load()
+                    self.following = True
+                    delay = SPOT_CACHE_RESYNC_SECONDS
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Could not resync the spot cache: {e}. Retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, SPOT_CACHE_RESYNC_MAX_SECONDS)
+                    continue
+
+            try:
+                async for change in self._stream:
+                    self._apply(change)
+                print("Spot change stream ended. Resyncing the spot cache")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Spot change stream interrupted: {e}. Resyncing the spot cache")
+
+            #Changes made until the stream is reopened are missed, so spots are read from Mongo meanwhile
+            self.ready = False
+            self.following = False
+            await self._close_stream()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SPOT_CACHE_RESYNC_MAX_SECONDS)
+
+
+    async def _reload_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(SPOT_CACHE_RELOAD_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Could not reload the spot cache: {e}")
+
+
+    def _apply(self, change: dict) -> None:
+        operation = change["operationType"]
+        if operation in ("insert", "replace", "update"):
+            if change.get("fullDocument") is None:
+                #The spot was deleted before its update was looked up
+                self.remove(str(change["documentKey"]["_id"]))
+            else:
+                self.put(change["fullDocument"])
+        elif operation == "delete":
+            self.remove(str(change["documentKey"]["_id"]))
+        else:
+            #drop, rename or invalidate end the stream, it is reopened and the cache reloaded
+            raise RuntimeError(f"spots collection {operation}")
+        self.changes_applied += 1
+
+
+    def put(self, spot: dict) -> None:
+        """Stores a spot, unless the cache already holds a status observed after this one"""
+        spot_id = str(spot["_id"])
+        cached = self._spots.get(spot_id)
+        if cached is not None and cached.get("observed_at") is not None and spot.get("observed_at") is not None \
+                and spot["observed_at"] < cached["observed_at"]:
+            return
+        if cached is None:
+            self._order = None
+        self._spots[spot_id] = dict(spot)
+        self.version += 1
+
+
+    def remove(self, spot_id: str) -> None:
+        if self._spots.pop(spot_id, None) is not None:
+            self._order = None
+            self.version += 1
+
+
+    def get(self, spot_id: str) -> dict | None:
+        return self._spots.get(spot_id)
+
+
+    def find(self, filters: dict = {}, after: str | None = None, limit: int | None = None) -> list[dict]:
+        """The cached spots matching `filters` in `_id` order, starting after the spot with id `after`"""
+        if self._order is None:
+            self._order = sorted(self._spots)
+        start = bisect_right(self._order, str(ObjectId(after))) if after is not None else 0
+        spots = []
+        for spot_id in self._order[start:]:
+            spot = self._spots[spot_id]
+            if matches(spot, filters):
+                spots.append(spot)
+                if limit is not None and len(spots) == limit:
+                    break
+        return spots
+
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "following_changes": self.following,
+            "spots": len(self._spots),
+            "version": self.version,
+            "reloads": self.reloads,
+            "changes_applied": self.changes_applied
+        }
+
+
+spot_cache = SpotCache()
@@ -0,0 +1,42 @@
+"""Spot status change events, published on the exchange for services that track occupancy."""
+
+import json
+from datetime import datetime, timezone
+
+from .rabbit_connector import publish_message
+from .spot_stream import spot_stream
+
+SPOT_STATUS_ROUTING_KEY = "spot_status"
+
+
+def spot_status_event(before: dict | None, after: dict | None) -> dict | None:
+    """Builds the status change event between two versions of a spot document. `before` is
+    `None` for a created spot and `after` is `None` for a removed one.
+
+    Returns:
+        dict | None: The event, or `None` when the status did not change
+    """
+    previous_status = before["status"] if before is not None else None
+    status = after["status"] if after is not None else None
+    if previous_status == status:
+        return None
+    
+    spot = after if after is not None else before
+    return {
+        "spot_id": str(spot["_id"]),
+        "floor_level": spot["floor_level"],
+        "spot_number": spot.get("spot_number"),
+        "status": status,
+        "previous_status": previous_status,
+        "changed_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def publish_spot_change(before: dict | None, after: dict | None) -> None:
+    """Publishes the status change between two versions of a spot document, if there is one, on
+    the exchange and to the GET /spots/stream subscribers of this process. These events are best
+    effort, consumers resync from GET /spots/stats when they go stale."""
+    event = spot_status_event(before, after)
+    if event is not None:
+        publish_message(SPOT_STATUS_ROUTING_KEY, json.dumps(event))
+        spot_stream.publish(event)
@@ -0,0 +1,86 @@
+"""In-process fan out of spot status change events to the GET /spots/stream subscribers. Events are
+the same ones published on the exchange, pushed from the update path of this API process."""
+
+import asyncio
+import json
+import os
+
+#Events a subscriber may fall behind by before it is told to resync and dropped
+SPOT_STREAM_QUEUE_SIZE = int(os.getenv("SPOT_STREAM_QUEUE_SIZE", "1000"))
+#Seconds between keep-alive comments on an idle stream, so proxies do not close it
+SPOT_STREAM_HEARTBEAT_SECONDS = float(os.getenv("SPOT_STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+class SpotStreamBroadcaster:
+    """Hands every status change event to a bounded queue per subscriber. Publishing never
+    waits: a subscriber whose queue is full is disconnected instead of slowing the writers."""
+
+    def __init__(self, queue_size: int = SPOT_STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+
+    def publish(self, event: dict) -> None:
+        self.published += 1
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                #The subscriber missed events anyway, so the rest are dropped and its reader tells the client to resync
+                self._subscribers.discard(queue)
+                self.dropped_subscribers += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped_subscribers
+        }
+
+
+def sse_message(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_spot_changes(broadcaster: SpotStreamBroadcaster, heartbeat: float = SPOT_STREAM_HEARTBEAT_SECONDS):
+    """Yields the Server-Sent Events of a /spots/stream subscriber: a `ready` event once subscribed,
+    then a `spot_status` event per change. A subscriber that fell behind gets a `resync` event
+    and the stream ends, the client then reloads the spots and reconnects."""
+    queue = broadcaster.subscribe()
+    try:
+        yield sse_message("ready", {})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                yield sse_message("resync", {})
+                return
+            yield sse_message("spot_status", event)
+    finally:
+        broadcaster.unsubscribe(queue)
+
+
+spot_stream = SpotStreamBroadcaster()
@@ -0,0 +1,65 @@
+"""Concurrent booking load test against a running Central API.
+
+Every round fires `--concurrency` bookings at once for overlapping windows of the same spot,
+so exactly one booking per round may succeed. The test reports booking throughput and fails
+loudly if a round ever lets two overlapping bookings through.
+
+Run from the `/CentralAPI` directory:
+
+    python -m benchmarks.concurrent_bookings --url http://localhost:8000 --user <user_id> --spot <spot_id>
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+
+async def run_round(client: httpx.AsyncClient, args, round_start: datetime) -> int:
+    requests = [
+        client.post("/reservations", json={
+            "user_id": args.user,
+            "spot_id": args.spot,
+            "start_time": (round_start + timedelta(minutes=i)).isoformat(),
+            "end_time": (round_start + timedelta(minutes=i + args.length)).isoformat()
+        })
+        for i in range(args.concurrency)
+    ]
+    responses = await asyncio.gather(*requests)
+    return sum(1 for response in responses if response.status_code == 200)
+
+
+async def main(args):
+    #Leave a gap between rounds so no two rounds overlap each other
+    first_start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=args.days_ahead)
+    round_gap = timedelta(minutes=args.length + args.concurrency + 1)
+    
+    double_bookings = 0
+    created = 0
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        started = time.perf_counter()
+        for round_number in range(args.rounds):
+            succeeded = await run_round(client, args, first_start + round_number * round_gap)
+            created += succeeded
+            double_bookings += max(0, succeeded - 1)
+        elapsed = time.perf_counter() - started
+
+    attempts = args.rounds * args.concurrency
+    print(f"{attempts} booking attempts in {elapsed:.2f}s ({attempts / elapsed:.1f} attempts/s)")
+    print(f"{created} bookings created, {double_bookings} double bookings")
+    if double_bookings:
+        raise SystemExit("Overlapping bookings were accepted")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--user", required=True, help="Mongo id of an existing user")
+    parser.add_argument("--spot", required=True, help="Mongo id of an existing spot")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--length", type=int, default=30, help="Booking length in minutes")
+    parser.add_argument("--days-ahead", type=int, default=30)
+    asyncio.run(main(parser.parse_args()))
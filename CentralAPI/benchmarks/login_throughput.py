@@ -0,0 +1,124 @@
+"""Login throughput benchmark.
+
+Against a running Central API, signs up `--users` throwaway users and then fires `--logins`
+logins at `--concurrency` at a time, reporting logins per second, latency percentiles and how
+many attempts were turned away by the password hashing pool (503).
+
+Run from the `/CentralAPI` directory:
+
+    python -m benchmarks.login_throughput --url http://localhost:8000
+
+With `--in-process` no server is needed: the same verifications are run inline on the event loop
+and then through the hashing pool, reporting throughput and the worst event loop stall of each.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+import httpx
+
+PASSWORD = "benchmark-password"
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def sign_up_users(client: httpx.AsyncClient, count: int) -> list[str]:
+    prefix = uuid.uuid4().hex[:8]
+    usernames = [f"bench_{prefix}_{i}" for i in range(count)]
+    for username in usernames:
+        response = await client.post("/auth/signup", json={
+            "username": username,
+            "name": "Login Benchmark",
+            "email": f"{username}@example.com",
+            "password": PASSWORD
+        })
+        response.raise_for_status()
+    return usernames
+
+
+async def run_http(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        usernames = await sign_up_users(client, args.users)
+        gate = asyncio.Semaphore(args.concurrency)
+        latencies = []
+        statuses = {}
+
+        async def login(i: int):
+            async with gate:
+                started = time.perf_counter()
+                response = await client.post("/auth/login", data={"username": usernames[i % len(usernames)], "password": PASSWORD})
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(args.logins)))
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.logins} logins in {elapsed:.2f}s ({args.logins / elapsed:.1f} logins/s) at concurrency {args.concurrency}")
+    print(f"latency ms: p50 {percentile(latencies, 0.5):.1f}, p95 {percentile(latencies, 0.95):.1f}, p99 {percentile(latencies, 0.99):.1f}")
+    print(f"responses by status: {dict(sorted(statuses.items()))}")
+
+
+async def measure(verifications, count: int) -> tuple[float, float]:
+    """Runs the verifications while a ticker measures how long the event loop went without running it"""
+    stalls = []
+
+    async def ticker():
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append((time.perf_counter() - before) * 1000)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    await verifications()
+    elapsed = time.perf_counter() - started
+    #Let the ticker record the stall it was blocked in
+    await asyncio.sleep(0.01)
+    tick.cancel()
+    return count / elapsed, max(stalls)
+
+
+async def run_in_process(args):
+    os.environ.setdefault("PASSWORD_HASH_MAX_WAITING", str(args.logins))
+    #Importing the auth module creates the Mongo client, which only connects when used
+    os.environ.setdefault("DB_NAME", "benchmark")
+    from app.utils.auth import pwd_context, password_hasher
+
+    hashed = pwd_context.hash(PASSWORD)
+
+    async def inline():
+        for _ in range(args.logins):
+            pwd_context.verify(PASSWORD, hashed)
+
+    async def pooled():
+        gate = asyncio.Semaphore(args.concurrency)
+
+        async def verify():
+            async with gate:
+                await password_hasher.verify(PASSWORD, hashed)
+
+        await asyncio.gather(*(verify() for _ in range(args.logins)))
+
+    for name, verifications in (("inline", inline), (f"pool ({password_hasher.workers} workers)", pooled)):
+        throughput, stall = await measure(verifications, args.logins)
+        print(f"{name}: {throughput:.1f} verifications/s, longest event loop stall {stall:.1f} ms")
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=20, help="Users signed up for the benchmark")
+    parser.add_argument("--logins", type=int, default=500, help="Login attempts in total")
+    parser.add_argument("--concurrency", type=int, default=50, help="Login attempts in flight at once")
+    parser.add_argument("--in-process", action="store_true", help="Compare inline and pooled bcrypt without a server")
+    args = parser.parse_args()
+
+    asyncio.run(run_in_process(args) if args.in_process else run_http(args))
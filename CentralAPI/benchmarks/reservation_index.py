@@ -0,0 +1,94 @@
+"""Compares the conflict check of a booking with and without the in-process reservation index.
+
+Run from the `/CentralAPI` directory:
+
+    python -m benchmarks.reservation_index
+
+The index is always measured. Set `MONGO_URI` (and optionally `DB_NAME`) to also measure the
+database conflict query against a scratch `reservations_benchmark` collection.
+"""
+
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.utils.reservation_index import ReservationIndex
+
+SIZES = [10_000, 1_000_000]
+SPOTS = 1_000
+CHECKS = 20_000
+MONGO_CHECKS = 2_000
+
+
+def generate_reservations(size: int, spot_ids: list[ObjectId]) -> list[dict]:
+    """Back to back 30 minute reservations spread evenly over the spots"""
+    start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+    per_spot = size // len(spot_ids)
+    reservations = []
+    for spot_id in spot_ids:
+        for slot in range(per_spot):
+            slot_start = start + timedelta(minutes=30 * slot)
+            reservations.append({
+                "spot_id": spot_id,
+                "start_time": slot_start,
+                "end_time": slot_start + timedelta(minutes=30)
+            })
+    return reservations
+
+
+def generate_requests(reservations: list[dict], count: int) -> list[dict]:
+    return [
+        {**reservation, "start_time": reservation["start_time"] + timedelta(minutes=10)}
+        for reservation in random.choices(reservations, k=count)
+    ]
+
+
+def bench_index(reservations: list[dict], requests: list[dict]) -> float:
+    index = ReservationIndex()
+    for reservation in reservations:
+        index.add(reservation["spot_id"], reservation["start_time"], reservation["end_time"])
+
+    started = time.perf_counter()
+    for request in requests:
+        index.conflicts(request["spot_id"], request["start_time"], request["end_time"])
+    return len(requests) / (time.perf_counter() - started)
+
+
+def bench_mongo(reservations: list[dict], requests: list[dict]) -> float:
+    from pymongo import MongoClient, ASCENDING
+
+    client = MongoClient(os.environ["MONGO_URI"])
+    collection = client.get_database(os.getenv("DB_NAME", "benchmarks")).get_collection("reservations_benchmark")
+    collection.drop()
+    collection.create_index([("spot_id", ASCENDING), ("start_time", ASCENDING), ("end_time", ASCENDING)])
+    for i in range(0, len(reservations), 50_000):
+        collection.insert_many([dict(reservation) for reservation in reservations[i:i + 50_000]], ordered=False)
+
+    started = time.perf_counter()
+    for request in requests[:MONGO_CHECKS]:
+        collection.find_one({
+            "spot_id": request["spot_id"],
+            "start_time": {"$lt": request["end_time"]},
+            "end_time": {"$gt": request["start_time"]}
+        })
+    rate = MONGO_CHECKS / (time.perf_counter() - started)
+
+    collection.drop()
+    client.close()
+    return rate
+
+
+if __name__ == "__main__":
+    random.seed(892)
+    spot_ids = [ObjectId() for _ in range(SPOTS)]
+
+    for size in SIZES:
+        reservations = generate_reservations(size, spot_ids)
+        requests = generate_requests(reservations, CHECKS)
+
+        print(f"{size:>9} reservations  index: {bench_index(reservations, requests):>12,.0f} checks/s")
+        if os.getenv("MONGO_URI"):
+            print(f"{size:>9} reservations  mongo: {bench_mongo(reservations, requests):>12,.0f} checks/s")
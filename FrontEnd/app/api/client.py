@@ -1,12 +1,21 @@
+import asyncio
+import httpx
+import json
 import requests
+import time
 from datetime import datetime
 from config import config
+from api.pricing import RateCurve
 from api.models import (
     User, UserCreate, UserUpdate, UserSignUp, Token, ListResponse,
     ParkingSpot, ParkingSpotBase, ParkingSpotUpdate,
     Reservation, ReservationCreate
 )
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, AsyncIterator
+
+def auth_headers(token: Optional[str]) -> Dict[str, str]:
+    # Changing or deleting an account requires the token of its user
+    return {"Authorization": f"Bearer {token}"} if token else {}
 
 class ParkingAPIClient:
     def __init__(self):
@@ -35,6 +44,9 @@ class ParkingAPIClient:
             token = Token(**response.json())
             self.token = token.access_token
             return True
+        if response.status_code == 401:
+            return False
+        response.raise_for_status()  # 429 when rate limited, 503 when the API is busy hashing
         return False
 
     # User Endpoints
@@ -65,6 +77,7 @@ class ParkingAPIClient:
         response = self.session.put(
             f"{self.base_url}/users/{user_id}",
             json=payload,
+            headers=auth_headers(self.token),
             timeout=config.DEFAULT_TIMEOUT
         )
         response.raise_for_status()
@@ -73,6 +86,7 @@ class ParkingAPIClient:
     def delete_user(self, user_id: str) -> bool:
         response = self.session.delete(
             f"{self.base_url}/users/{user_id}",
+            headers=auth_headers(self.token),
             timeout=config.DEFAULT_TIMEOUT
         )
         return response.status_code == 204
@@ -188,7 +202,221 @@ class PricingAPIClient:
         return response.json().get("minute_rate")
     
     def fetch_total_price(self, start: datetime, end: datetime) -> float:
-        
-        rate = self.fetch_rate(start)
-        time_diff_minutes = (end - start).total_seconds() / 60
-        return round(time_diff_minutes * rate, 2)
\ No newline at end of file
+        # Quoted by the pricing service, so the rounding matches the reservation price
+        response = self.session.post(
+            url=f"{self.base_url}/quote",
+            json={"intervals": [{"start": start.isoformat(), "end": end.isoformat()}]},
+            timeout=config.DEFAULT_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()["quotes"][0]["total_price"]
+
+
+# Methods that can be repeated without side effects, so they are retried on any transport error or gateway error.
+# DELETE is left out: repeating one that already went through answers 404, which would read as a failed delete
+IDEMPOTENT_METHODS = {"GET", "PUT"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class AsyncAPIClient:
+    """Base of the async clients. Requests share one pooled httpx.AsyncClient, so page handlers await
+    them without blocking the event loop. Every call takes an optional timeout and retry count."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=config.DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=config.MAX_CONNECTIONS, max_keepalive_connections=config.MAX_CONNECTIONS)
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _request(self, method: str, path: str, timeout: Optional[float] = None, retries: Optional[int] = None, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+        retries = config.MAX_RETRIES if retries is None else retries
+        idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+        for attempt in range(retries + 1):
+            try:
+                response = await self.client.request(method, path, timeout=timeout or config.DEFAULT_TIMEOUT, **kwargs)
+                if attempt == retries or not idempotent or response.status_code not in RETRY_STATUS_CODES:
+                    return response
+            except httpx.TransportError as e:
+                # Other requests are only retried when they never reached the server
+                if attempt == retries or (not idempotent and not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))):
+                    raise
+            await asyncio.sleep(config.RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+
+class AsyncParkingAPIClient(AsyncAPIClient):
+    def __init__(self):
+        super().__init__(config.API_BASE_URL)
+
+    # Authentication
+    async def signup(self, username: str, password: str, name: str, email: str, timeout: Optional[float] = None) -> UserSignUp:
+        response = await self._request(
+            "POST", "/auth/signup",
+            json={"username": username, "password": password, "name": name, "email": email},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return UserSignUp(**response.json())
+
+    async def login(self, username: str, password: str, timeout: Optional[float] = None) -> Optional[str]:
+        # Returns the user's access token, or None for bad credentials. The client is shared by every
+        # session, so the token is kept by the caller rather than on the client
+        response = await self._request(
+            "POST", "/auth/login",
+            data={"username": username, "password": password},  # Form data for OAuth2PasswordRequestForm
+            timeout=timeout
+        )
+        if response.status_code == 200:
+            return Token(**response.json()).access_token
+        if response.status_code == 401:
+            return None
+        response.raise_for_status()  # 429 when rate limited, 503 when the API is busy hashing
+        return None
+
+    # User Endpoints
+    async def get_users(self, username: Optional[str] = None, email: Optional[str] = None, name: Optional[str] = None, timeout: Optional[float] = None) -> ListResponse:
+        params = {k: v for k, v in {"username": username, "email": email, "name": name}.items() if v is not None}
+        response = await self._request("GET", "/users", params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        records = [User(**record) for record in data["records"]]
+        return ListResponse(records=records, count=data.get("count"))
+
+    async def get_user(self, user_id: str, timeout: Optional[float] = None) -> User:
+        response = await self._request("GET", f"/users/{user_id}", timeout=timeout)
+        response.raise_for_status()
+        return User(**response.json())
+
+    async def update_user(self, user_id: str, user_update: UserUpdate, token: str, timeout: Optional[float] = None) -> User:
+        payload = {k: v for k, v in user_update.__dict__.items() if v is not None}
+        response = await self._request("PUT", f"/users/{user_id}", json=payload, headers=auth_headers(token), timeout=timeout)
+        response.raise_for_status()
+        return User(**response.json())
+
+    async def delete_user(self, user_id: str, token: str, timeout: Optional[float] = None) -> bool:
+        response = await self._request("DELETE", f"/users/{user_id}", headers=auth_headers(token), timeout=timeout)
+        return response.status_code == 204
+
+    # Spot Endpoints
+    async def get_spots(self, filters: Optional[Dict[str, tuple[str, str]]] = None, timeout: Optional[float] = None) -> ListResponse:
+        params = {}
+        if filters:
+            params["filter"] = [f"{field}:{op}:{val}" for field, (op, val) in filters.items()]
+        response = await self._request("GET", "/spots", params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        records = [ParkingSpot(**record) for record in data["records"]]
+        return ListResponse(records=records, count=data.get("count"))
+
+    async def get_spot(self, spot_id: str, timeout: Optional[float] = None) -> ParkingSpot:
+        response = await self._request("GET", f"/spots/{spot_id}", timeout=timeout)
+        response.raise_for_status()
+        return ParkingSpot(**response.json())
+
+    async def create_spot(self, floor_level: int, spot_number: int, status: str = "vacant", timeout: Optional[float] = None) -> ParkingSpot:
+        response = await self._request(
+            "POST", "/spots",
+            json={"floor_level": floor_level, "spot_number": spot_number, "status": status},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return ParkingSpot(**response.json())
+
+    async def update_spot(self, spot_id: str, spot_update: ParkingSpotUpdate, timeout: Optional[float] = None) -> ParkingSpot:
+        payload = {k: v for k, v in spot_update.__dict__.items() if v is not None}
+        response = await self._request("PUT", f"/spots/{spot_id}", json=payload, timeout=timeout)
+        response.raise_for_status()
+        return ParkingSpot(**response.json())
+
+    async def delete_spot(self, spot_id: str, timeout: Optional[float] = None) -> bool:
+        response = await self._request("DELETE", f"/spots/{spot_id}", timeout=timeout)
+        return response.status_code == 204
+
+    async def stream_spot_changes(self) -> AsyncIterator[tuple[str, dict]]:
+        """Yields the (event, data) pairs of the /spots/stream Server-Sent Events until the server ends the stream.
+        Streams get their own connection, so open pages do not hold connections of the shared pool."""
+        timeout = httpx.Timeout(config.DEFAULT_TIMEOUT, read=None)  # The stream stays open between changes
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            async with client.stream("GET", f"{self.base_url}/spots/stream") as response:
+                response.raise_for_status()
+                event, data = "message", []
+                async for line in response.aiter_lines():
+                    if line == "":
+                        if data:
+                            yield event, json.loads("\n".join(data))
+                        event, data = "message", []
+                    elif line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data.append(line[len("data:"):].strip())
+
+    # Reservation Endpoints
+    async def get_reservations(self, filters: Optional[Dict[str, tuple[str, str]]] = None, timeout: Optional[float] = None) -> ListResponse:
+        params = {}
+        if filters:
+            params["filter"] = [f"{field}:{op}:{val}" for field, (op, val) in filters.items()]
+        response = await self._request("GET", "/reservations", params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        records = [Reservation(**record) for record in data["records"]]
+        return ListResponse(records=records, count=data.get("count"))
+
+    async def get_reservation(self, reservation_id: str, timeout: Optional[float] = None) -> Reservation:
+        response = await self._request("GET", f"/reservations/{reservation_id}", timeout=timeout)
+        response.raise_for_status()
+        return Reservation(**response.json())
+
+    async def create_reservation(self, reservation: ReservationCreate, timeout: Optional[float] = None) -> Reservation:
+        response = await self._request("POST", "/reservations", json=reservation.__dict__, timeout=timeout)
+        response.raise_for_status()
+        return Reservation(**response.json())
+
+    async def delete_reservation(self, reservation_id: str, timeout: Optional[float] = None) -> bool:
+        response = await self._request("DELETE", f"/reservations/{reservation_id}", timeout=timeout)
+        return response.status_code == 204
+
+
+class AsyncPricingAPIClient(AsyncAPIClient):
+    def __init__(self):
+        super().__init__(config.PRICING_BASE_URL)
+        self._curve: Optional[RateCurve] = None
+        self._curve_fetched_at = 0.0
+        self._curve_lock = asyncio.Lock()  # Pages opening at once wait for one fetch
+
+    async def fetch_rate(self, timestamp: datetime, timeout: Optional[float] = None) -> float:
+        payload = {"timestamp": timestamp.isoformat()}
+        # /calculate-rate only reads, so it is safe to retry like a GET
+        response = await self._request("POST", "/calculate-rate", json=payload, timeout=timeout, idempotent=True)
+        response.raise_for_status()
+        return response.json().get("minute_rate")
+
+    async def fetch_rate_curve(self, timeout: Optional[float] = None) -> RateCurve:
+        """The rate curve of the coming week, fetched at most once every RATE_CURVE_TTL_SECONDS and shared by every page"""
+        async with self._curve_lock:
+            if self._curve is None or time.monotonic() - self._curve_fetched_at >= config.RATE_CURVE_TTL_SECONDS:
+                response = await self._request("GET", "/rates", timeout=timeout)
+                response.raise_for_status()
+                self._curve = RateCurve.from_response(response.json())
+                self._curve_fetched_at = time.monotonic()
+        return self._curve
+
+    async def fetch_quote(self, start: datetime, end: datetime, timeout: Optional[float] = None) -> float:
+        response = await self._request(
+            "POST", "/quote",
+            json={"intervals": [{"start": start.isoformat(), "end": end.isoformat()}]},
+            timeout=timeout,
+            idempotent=True
+        )
+        response.raise_for_status()
+        return response.json()["quotes"][0]["total_price"]
+
+    async def fetch_total_price(self, start: datetime, end: datetime, timeout: Optional[float] = None) -> float:
+        price = (await self.fetch_rate_curve(timeout=timeout)).price(start, end)
+        if price is None:
+            # Runs past the curve, so it is quoted by the pricing service
+            price = await self.fetch_quote(start, end, timeout=timeout)
+        return price
@@ -0,0 +1,55 @@
+import math
+from datetime import datetime
+from typing import List, Optional
+
+
+def billed_minutes(start: datetime, end: datetime) -> int:
+    # The pricing service charges every started minute
+    return math.ceil((end - start).total_seconds() / 60)
+
+
+class RateCurve:
+    """The per minute rates of the pricing service's /rates endpoint, in consecutive buckets from `start`.
+    Prices are computed locally with the service's rules: every started minute is charged at the rate of
+    the bucket it starts in, and the total is summed in cents, so previews match the reservation price."""
+
+    def __init__(self, start: datetime, bucket_minutes: int, minute_rates: List[float]):
+        self.start = start
+        self.bucket_minutes = bucket_minutes
+        self.minutes = len(minute_rates) * bucket_minutes
+        self.cents = [round(rate * 100) for rate in minute_rates]
+        # Entry b is the price in cents of every minute before bucket b
+        self.cumulative = [0]
+        for cents in self.cents:
+            self.cumulative.append(self.cumulative[-1] + cents * bucket_minutes)
+
+    @classmethod
+    def from_response(cls, data: dict) -> "RateCurve":
+        return cls(datetime.fromisoformat(data["start"]), data["bucket_minutes"], data["minute_rates"])
+
+    def _offset(self, at: datetime) -> int:
+        # The pricing service goes by wall clock time
+        return int((at.replace(tzinfo=None, second=0, microsecond=0) - self.start).total_seconds() // 60)
+
+    def _cents_before(self, minute: int) -> int:
+        bucket, into_bucket = divmod(minute, self.bucket_minutes)
+        if into_bucket == 0:
+            return self.cumulative[bucket]
+        return self.cumulative[bucket] + self.cents[bucket] * into_bucket
+
+    def minute_rate(self, at: datetime) -> Optional[float]:
+        """The rate per minute at `at`, or None when it is outside the curve"""
+        offset = self._offset(at)
+        if offset < 0 or offset >= self.minutes:
+            return None
+        return self.cents[offset // self.bucket_minutes] / 100
+
+    def price(self, start: datetime, end: datetime) -> Optional[float]:
+        """The price of a reservation, or None when it runs outside the curve"""
+        if end <= start:
+            raise ValueError("End time must be after start time")
+        offset = self._offset(start)
+        minutes = billed_minutes(start, end)
+        if offset < 0 or offset + minutes > self.minutes:
+            return None
+        return round((self._cents_before(offset + minutes) - self._cents_before(offset)) / 100, 2)
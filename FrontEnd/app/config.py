@@ -1,6 +1,14 @@
+import os
+import secrets
+
 class Config:
     API_BASE_URL = "https://central-api-gud7ethebpctcag5.canadacentral-01.azurewebsites.net"
     PRICING_BASE_URL = "https://smart-park-pricing-service-a8gwb6awatbehkh8.canadacentral-01.azurewebsites.net"
     DEFAULT_TIMEOUT = 10
+    MAX_CONNECTIONS = 100  # Per service, shared by every connected user
+    MAX_RETRIES = 2
+    RETRY_BACKOFF_SECONDS = 0.2
+    STORAGE_SECRET = os.getenv("STORAGE_SECRET", secrets.token_urlsafe(32))  # Signs the session cookie, set it to keep sessions across restarts
+    RATE_CURVE_TTL_SECONDS = 60  # Rates follow the garage occupancy, a minute old curve is close enough for previews
 
 config = Config()
\ No newline at end of file
@@ -1,13 +1,17 @@
-from nicegui import ui
+from nicegui import ui, app
 from ui.pages.landing import landing_page
 from ui.pages.login import login_page
 from ui.pages.signup import signup_page
 from ui.pages.overview import overview_page
 from ui.pages.my_reservations import my_reservations_page
-from api.client import ParkingAPIClient
+from api.client import AsyncParkingAPIClient, AsyncPricingAPIClient
+from config import config
 
-#global api instance
-api_client = ParkingAPIClient()
+#global api instances, their connection pools are shared by every page
+api_client = AsyncParkingAPIClient()
+pricing_client = AsyncPricingAPIClient()
+app.on_shutdown(api_client.close)
+app.on_shutdown(pricing_client.close)
 
 current_user_id = None
 def session_login_page():
@@ -17,12 +21,18 @@ def session_login_page():
 def session_signup_page():
     global current_user_id
     signup_page(api_client, lambda user_id: globals().update({"current_user_id": user_id}))
-    
+
+async def session_overview_page():
+    await overview_page(api_client, pricing_client, current_user_id)
+
+async def session_my_reservations_page():
+    await my_reservations_page(api_client, current_user_id)
+
 #Define routes
 ui.page("/")(landing_page)
 ui.page("/login")(session_login_page)
 ui.page("/signup")(session_signup_page)
-ui.page("/overview")(lambda: overview_page(api_client, current_user_id))
-ui.page("/my_reservations")(lambda: my_reservations_page(api_client, current_user_id))
+ui.page("/overview")(session_overview_page)
+ui.page("/my_reservations")(session_my_reservations_page)
 
-ui.run(host="0.0.0.0", port=80, title="Smart Parking System", reload=True)
\ No newline at end of file
+ui.run(host="0.0.0.0", port=80, title="Smart Parking System", reload=True, storage_secret=config.STORAGE_SECRET)
\ No newline at end of file
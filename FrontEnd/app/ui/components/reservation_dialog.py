@@ -1,9 +1,9 @@
 from nicegui import ui
-from api.client import ParkingAPIClient, PricingAPIClient
+from api.client import AsyncParkingAPIClient, AsyncPricingAPIClient
 from api.models import ReservationCreate, ParkingSpot
 from datetime import datetime, timedelta
 
-def reservation_dialog(api_client: ParkingAPIClient, spot: ParkingSpot, user_id: str, on_success):
+async def reservation_dialog(api_client: AsyncParkingAPIClient, pricing_client: AsyncPricingAPIClient, spot: ParkingSpot, user_id: str, on_success):
     """Opens a dialog to create a reservation for a given spot."""
     with ui.dialog() as dialog, ui.card().classes("w-96"):
         ui.label(f"Reserve Spot {spot.spot_number} on Floor {spot.floor_level}").classes("text-xl font-bold mb-4")
@@ -11,26 +11,34 @@ def reservation_dialog(api_client: ParkingAPIClient, spot: ParkingSpot, user_id:
         start_time = ui.input("Start Time", value=(datetime.now() + timedelta(minutes=5)).strftime("%Y-%m-%dT%H:%M")).props("type=datetime-local").classes("w-full mb-4")
         end_time = ui.input("End Time", value=(datetime.now() + timedelta(hours=1, minutes=5)).strftime("%Y-%m-%dT%H:%M")).props("type=datetime-local").classes("w-full mb-4")
         
+        # The rate curve is loaded once per dialog (at most once a minute overall), so previews are computed locally
+        try:
+            curve = await pricing_client.fetch_rate_curve()
+        except Exception:
+            curve = None
+
         # Reactive price display
         @ui.refreshable
-        def price_display():
+        async def price_display():
             try:
-                pricer = PricingAPIClient()
                 start_dt = datetime.fromisoformat(start_time.value.replace("T", " "))
                 end_dt = datetime.fromisoformat(end_time.value.replace("T", " "))
-                price = pricer.fetch_total_price(start_dt, end_dt)
+                price = curve.price(start_dt, end_dt) if curve is not None else None
+                if price is None:
+                    # Past the curve, or it could not be loaded, so quoted by the pricing service
+                    price = await pricing_client.fetch_quote(start_dt, end_dt)
                 ui.label(f"Estimated Price: ${price:.2f}").classes("text-base mb-4")
             except Exception:
                 ui.label("Estimated Price: $0.00 (invalid time)").classes("text-base mb-4 text-gray-500")
 
         # Initial render of price
-        price_display()
+        await price_display()
 
         # Update price on input change
         start_time.on("change", price_display.refresh)
         end_time.on("change", price_display.refresh)
 
-        def handle_reserve():
+        async def handle_reserve():
 
             if not start_time.value or not end_time.value:
                 ui.notify("Please fill in both start and end times", type="negative")
@@ -51,10 +59,10 @@ def reservation_dialog(api_client: ParkingAPIClient, spot: ParkingSpot, user_id:
                     start_time=start_dt.isoformat(),
                     end_time=end_dt.isoformat()
                 )
-                api_client.create_reservation(reservation)
+                await api_client.create_reservation(reservation)
                 ui.notify(f"Spot {spot.spot_number} reserved successfully!", type="positive")
                 dialog.close()
-                on_success()  #callback for refresh
+                await on_success()  #callback for refresh
             except Exception as e:
                 ui.notify(f"Failed to reserve spot: {str(e)}", type="negative")
 
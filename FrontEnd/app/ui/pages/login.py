@@ -1,8 +1,8 @@
-from nicegui import ui
-import requests
-from api.client import ParkingAPIClient
+from nicegui import ui, app
+import httpx
+from api.client import AsyncParkingAPIClient
 
-def login_page(api_client: ParkingAPIClient, on_login):
+def login_page(api_client: AsyncParkingAPIClient, on_login):
 
     with ui.column().classes("w-full max-w-md mx-auto p-4 flex flex-col items-center justify-center min-h-screen"):
         ui.label("Login").classes("text-3xl font-bold mb-8 text-center")
@@ -10,22 +10,32 @@ def login_page(api_client: ParkingAPIClient, on_login):
         username = ui.input("Username", placeholder="Enter your username").props("outlined").classes("w-full mb-4")
         password = ui.input("Password", placeholder="Enter your password").props("outlined type=password").classes("w-full mb-4")
 
-        def handle_login():
+        async def handle_login():
             #make sure fields are populated
             if not username.value or not password.value:
                 ui.notify("Please fill in all fields", type="negative")
                 return
 
             try:
-                if api_client.login(username.value, password.value):
-                    
-                    user = api_client.get_users(username=username.value).records[0]
+                token = await api_client.login(username.value, password.value)
+                if token:
+                    # Kept per browser session, the API client is shared by every user
+                    app.storage.user["token"] = token
+                    user = (await api_client.get_users(username=username.value)).records[0]
                     on_login(user._id)
                     ui.notify("Login successful!", type="positive")
                     ui.navigate.to("/overview")
                 else:
                     ui.notify("Invalid username or password", type="negative")
-            except requests.exceptions.RequestException as e:
+            except httpx.HTTPStatusError as e:
+                retry_after = e.response.headers.get("Retry-After", "a few")
+                if e.response.status_code == 429:
+                    ui.notify(f"Too many login attempts, try again in {retry_after} seconds", type="negative")
+                elif e.response.status_code == 503:
+                    ui.notify(f"The server is busy, try again in {retry_after} seconds", type="negative")
+                else:
+                    ui.notify(f"Login failed: {str(e)}", type="negative")
+            except httpx.HTTPError as e:
                 ui.notify(f"Login failed: {str(e)}", type="negative")
 
         ui.button("Login", on_click=handle_login).classes("w-48 bg-blue-500 text-white mb-4")
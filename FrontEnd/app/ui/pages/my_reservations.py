@@ -1,16 +1,16 @@
 from nicegui import ui
 from datetime import datetime
-from api.client import ParkingAPIClient
+from api.client import AsyncParkingAPIClient
 
-def my_reservations_page(api_client: ParkingAPIClient, user_id: str):
+async def my_reservations_page(api_client: AsyncParkingAPIClient, user_id: str):
     if not user_id:
         ui.notify("Please log in to view this page", type="negative")
         ui.navigate.to("/login")
         return
 
-    def fetch_reservations():
+    async def fetch_reservations():
         try:
-            reservations_res = api_client.get_reservations({"user_id": ("eq", user_id)})
+            reservations_res = await api_client.get_reservations({"user_id": ("eq", user_id)})
             return reservations_res
         except Exception as e:
             ui.notify(f"Failed to load reservations: {str(e)}", type="negative")
@@ -26,8 +26,8 @@ def my_reservations_page(api_client: ParkingAPIClient, user_id: str):
         ui.label("Smart Parking System").classes("text-2xl font-bold")
 
     @ui.refreshable
-    def render_content():
-        reservations_res = fetch_reservations()
+    async def render_content():
+        reservations_res = await fetch_reservations()
         reservations = reservations_res.records
         with ui.column().classes("w-full max-w-4xl mx-auto p-4"):
             ui.label("My Reservations").classes("text-3xl font-bold mb-6 text-center")
@@ -47,14 +47,16 @@ def my_reservations_page(api_client: ParkingAPIClient, user_id: str):
                                 on_click=lambda r=reservation: handle_delete(r._id)
                             ).classes("bg-red-500 text-white")
 
-    def handle_delete(reservation_id: str):
+    async def handle_delete(reservation_id: str):
         try:
-            if api_client.delete_reservation(reservation_id):
+            if await api_client.delete_reservation(reservation_id):
                 ui.notify("Reservation deleted successfully!", type="positive")
                 render_content.refresh()
             else:
                 ui.notify("Failed to delete reservation", type="negative")
         except Exception as e:
             ui.notify(f"Error deleting reservation: {str(e)}", type="negative")
+            # A timed out delete may still have gone through, show the list as it is now
+            render_content.refresh()
 
-    render_content()
\ No newline at end of file
+    await render_content()
\ No newline at end of file
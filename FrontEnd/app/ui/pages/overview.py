@@ -1,24 +1,24 @@
-from nicegui import ui
-from collections import defaultdict
-from api.client import ParkingAPIClient, PricingAPIClient
+import asyncio
+import time
+from nicegui import ui, background_tasks
+from collections import Counter
+from api.client import AsyncParkingAPIClient, AsyncPricingAPIClient
 from ui.components.reservation_dialog import reservation_dialog
 from datetime import datetime
 
 current_user_id = None
 
-def overview_page(api_client: ParkingAPIClient, user_id: str):
+VACANT_STYLE = "text-base mr-4 border border-green-200 bg-green-300 p-1"
+TAKEN_STYLE = "text-base mr-4 border border-red-400 bg-red-500 p-1"
+STREAM_RETRY_SECONDS = 5
+STREAM_RETRY_MAX_SECONDS = 60
+
+async def overview_page(api_client: AsyncParkingAPIClient, pricing_client: AsyncPricingAPIClient, user_id: str):
     if not user_id:
         ui.notify("Please log in to view this page", type="negative")
         ui.navigate.to("/login")
         return
-    
-    def fetch_spots():
-        try:
-            return api_client.get_spots()
-        except Exception as e:
-            ui.notify(f"Failed to load spots: {str(e)}", type="negative")
-            return []
-        
+
     with ui.header().classes("flex items-center justify-between"):
         with ui.button(icon="menu").classes("ml-2"):
             with ui.menu() as menu:
@@ -26,55 +26,173 @@ def overview_page(api_client: ParkingAPIClient, user_id: str):
                 ui.menu_item("My Reservations", lambda: ui.navigate.to("/my_reservations")).classes("text-base")
                 ui.menu_item("Log Out", lambda: [globals().update({"current_user_id": None}), ui.navigate.to("/")]).classes("text-base")
         ui.label("Smart Parking System").classes("text-2xl font-bold")
-    
-    @ui.refreshable
-    def render_content():
-        spots_response = fetch_spots()
-        
-        spots = spots_response.records
-        total_spots = spots_response.count
-        total_available = sum(1 for spot in spots if spot.status == "vacant")
-        total_occupied = sum(1 for spot in spots if spot.status == "occupied")
-        
-        pricer = PricingAPIClient()
-        price_per_minute = pricer.fetch_rate(datetime.now())
-
-        spots_by_floor = defaultdict(list)
+
+    # Floors keyed by level, each with its spots and, once expanded, the rendered rows keyed by spot id.
+    # Rows of a collapsed floor are only built when it is first opened
+    floors = {}
+    spot_floors = {}
+    status_counts = Counter()
+
+    with ui.column().classes("w-full items-center max-w-4xl mx-auto p-4"):
+        ui.label("Parking Overview").classes("text-3xl font-bold mb-6 text-center")
+        with ui.card().classes("w-full mb-8"):
+            total_label = ui.label().classes("text-lg")
+            available_label = ui.label().classes("text-lg text-green-600")
+            occupied_label = ui.label().classes("text-lg text-red-600")
+            price_label = ui.label().classes("text-lg")
+
+        ui.label("Floor Levels").classes("text-2xl font-bold mb-4")
+        floors_column = ui.column().classes("w-full gap-0")
+
+        ui.button("Back to Home", on_click=lambda: ui.navigate.to("/")).classes("mt-4 bg-gray-500 text-white")
+
+    def update_counters():
+        total_label.set_text(f"Total Spots: {len(spot_floors)}")
+        available_label.set_text(f"Available Spots: {status_counts['vacant']}")
+        occupied_label.set_text(f"Occupied Spots: {status_counts['occupied']}")
+
+    def update_floor_title(floor):
+        floor["expansion"].set_text(f"Floor {floor['level']} ({floor['vacant']} available)")
+
+    def show_status(row, spot):
+        row["status"].set_text(spot.status.capitalize())
+        row["status"].classes(replace=VACANT_STYLE if spot.status == "vacant" else TAKEN_STYLE)
+        if spot.status == "vacant":
+            row["reserve"].classes(remove="bg-gray-400", add="bg-blue-500").enable()
+        else:
+            row["reserve"].classes(remove="bg-blue-500", add="bg-gray-400").disable()
+
+    def add_row(floor, spot):
+        with floor["expansion"]:
+            with ui.row().classes("w-full border border-gray-200 p-2 items-center") as element:
+                ui.label(f"Spot {spot.spot_number}").classes("font-semibold text-base mr-4")
+                row = {"element": element, "status": ui.label()}
+                ui.space()  # Pushes the button to the far right
+
+                row["reserve"] = ui.button("Reserve").classes("text-white").on("click", lambda spot=spot: reservation_dialog(api_client, pricing_client, spot, user_id, reload))
+        show_status(row, spot)
+        floor["rows"][spot._id] = row
+
+    def render_rows(floor):
+        if floor["rows"] is None:
+            floor["rows"] = {}
+            for spot in floor["spots"].values():
+                add_row(floor, spot)
+
+    def add_floor(level):
+        levels = sorted([*floors, level])
+        with floors_column:
+            expansion = ui.expansion(icon="floor").classes("w-full mb-2 text-xl border border-gray-300").props('header-class="font-extrabold text-lg"')
+        expansion.move(target_index=levels.index(level))
+        floor = {"level": level, "expansion": expansion, "spots": {}, "rows": None, "vacant": 0}
+        expansion.on_value_change(lambda e, floor=floor: render_rows(floor) if e.value else None)
+        floors[level] = floor
+        return floor
+
+    def add_spot(spot):
+        floor = floors.get(spot.floor_level) or add_floor(spot.floor_level)
+        floor["spots"][spot._id] = spot
+        spot_floors[spot._id] = floor
+        status_counts[spot.status] += 1
+        floor["vacant"] += spot.status == "vacant"
+        if floor["rows"] is not None:
+            add_row(floor, spot)
+        update_floor_title(floor)
+
+    def remove_spot(spot_id):
+        floor = spot_floors.pop(spot_id)
+        spot = floor["spots"].pop(spot_id)
+        status_counts[spot.status] -= 1
+        floor["vacant"] -= spot.status == "vacant"
+        if floor["rows"] is not None:
+            floor["rows"].pop(spot_id)["element"].delete()
+        if floor["spots"]:
+            update_floor_title(floor)
+        else:
+            floor["expansion"].delete()
+            del floors[floor["level"]]
+
+    def set_status(spot_id, status):
+        floor = spot_floors[spot_id]
+        spot = floor["spots"][spot_id]
+        status_counts[spot.status] -= 1
+        status_counts[status] += 1
+        floor["vacant"] += (status == "vacant") - (spot.status == "vacant")
+        spot.status = status
+        if floor["rows"] is not None:
+            show_status(floor["rows"][spot_id], spot)
+        update_floor_title(floor)
+
+    async def reload():
+        # Diffs the current spots against the rendered ones, so only changed rows are touched
+        try:
+            spots = (await api_client.get_spots()).records
+        except Exception as e:
+            ui.notify(f"Failed to load spots: {str(e)}", type="negative")
+            return
+
+        current = set()
         for spot in spots:
-            spots_by_floor[spot.floor_level].append(spot)
-
-        with ui.column().classes("w-full items-center max-w-4xl mx-auto p-4"):
-            ui.label("Parking Overview").classes("text-3xl font-bold mb-6 text-center")
-            with ui.card().classes("w-full mb-8"):
-                ui.label(f"Total Spots: {total_spots}").classes("text-lg")
-                ui.label(f"Available Spots: {total_available}").classes("text-lg text-green-600")
-                ui.label(f"Occupied Spots: {total_occupied}").classes("text-lg text-red-600")
-                ui.label(f"Price Rate: ${price_per_minute:.2f} per minute").classes("text-lg")
-
-            ui.label("Floor Levels").classes("text-2xl font-bold mb-4")
-            for floor in sorted(spots_by_floor.keys()):
-                with ui.expansion(f"Floor {floor}", icon="floor").classes("w-full mb-2 text-xl border border-gray-300"):
-
-                    ui.query(".q-expansion-item__header").classes("font-extrabold text-lg")
-                    
-                    for spot in spots_by_floor[floor]:
-                        with ui.row().classes("w-full border border-gray-200 p-2 items-center"):
-                            
-                            if spot.status == "vacant":
-                                style = "text-base mr-4 border border-green-200 bg-green-300 p-1"
-                            else:    
-                                style = "text-base mr-4 border border-red-400 bg-red-500 p-1"
-                                
-                            ui.label(f"Spot {spot.spot_number}").classes("font-semibold text-base mr-4")
-                            ui.label(spot.status.capitalize()).classes(style)
-                            ui.space()  # Pushes the button to the far right
-                            
-                            reserve_button = ui.button("Reserve").classes("text-white")
-                            if spot.status == "vacant":
-                                reserve_button.classes("bg-blue-500").on("click", lambda spot=spot: reservation_dialog(api_client, spot, user_id, lambda: render_content.refresh()))
-                            else:
-                                reserve_button.classes("bg-gray-400").disable()
-
-            ui.button("Back to Home", on_click=lambda: ui.navigate.to("/")).classes("mt-4 bg-gray-500 text-white")
-            
-    render_content()
\ No newline at end of file
+            current.add(spot._id)
+            floor = spot_floors.get(spot._id)
+            if floor is None:
+                add_spot(spot)
+            elif floor["spots"][spot._id].status != spot.status:
+                set_status(spot._id, spot.status)
+        for spot_id in [spot_id for spot_id in spot_floors if spot_id not in current]:
+            remove_spot(spot_id)
+        update_counters()
+
+        try:
+            price_per_minute = (await pricing_client.fetch_rate_curve()).minute_rate(datetime.now())
+            if price_per_minute is None:
+                price_per_minute = await pricing_client.fetch_rate(datetime.now())
+            price_label.set_text(f"Price Rate: ${price_per_minute:.2f} per minute")
+        except Exception as e:
+            ui.notify(f"Failed to load the price rate: {str(e)}", type="negative")
+
+    async def apply_change(change):
+        if change["spot_id"] not in spot_floors or change["status"] is None or change["previous_status"] is None:
+            # A spot was created or removed, reload the list
+            await reload()
+            return
+        set_status(change["spot_id"], change["status"])
+        update_counters()
+
+    async def follow_changes(client):
+        # Every (re)subscription reloads the list once, covering changes made while not subscribed.
+        # The first one also renders the page's initial list
+        delay = STREAM_RETRY_SECONDS
+        loaded = False
+        with client:
+            while True:
+                connected_at = time.monotonic()
+                try:
+                    async for event, data in api_client.stream_spot_changes():
+                        if event == "ready":
+                            await reload()
+                            loaded = True
+                        elif event == "spot_status":
+                            await apply_change(data)
+                        elif event == "resync":
+                            break
+                    reason = "Spot stream ended"
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    reason = f"Spot stream interrupted: {e}"
+                if not loaded:
+                    # The stream never came up, the spots are still shown
+                    await reload()
+                    loaded = True
+                # Waits after every disconnect, so a server that keeps closing the stream is not hammered.
+                # The backoff starts over once a stream stayed up for a while
+                if time.monotonic() - connected_at >= STREAM_RETRY_MAX_SECONDS:
+                    delay = STREAM_RETRY_SECONDS
+                print(f"{reason}. Reconnecting in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STREAM_RETRY_MAX_SECONDS)
+
+
+    stream_task = background_tasks.create(follow_changes(ui.context.client), name="overview spot stream")
+    ui.context.client.on_disconnect(stream_task.cancel)
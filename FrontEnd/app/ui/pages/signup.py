@@ -1,8 +1,8 @@
-from nicegui import ui
-from api.client import ParkingAPIClient
-import requests
+from nicegui import ui, app
+from api.client import AsyncParkingAPIClient
+import httpx
 
-def signup_page(api_client: ParkingAPIClient, on_signup):
+def signup_page(api_client: AsyncParkingAPIClient, on_signup):
 
     with ui.column().classes("w-full max-w-md mx-auto p-4 flex flex-col items-center justify-center min-h-screen"):
         ui.label("Sign Up").classes("text-3xl font-bold mb-8 text-center")
@@ -12,25 +12,28 @@ def signup_page(api_client: ParkingAPIClient, on_signup):
         email = ui.input("Email", placeholder="Enter your email").props("outlined").classes("w-full mb-4")
         password = ui.input("Password", placeholder="Choose a password").props("outlined type=password").classes("w-full mb-4")
 
-        def handle_signup():
+        async def handle_signup():
 
             if not all([username.value, name.value, email.value, password.value]):
                 ui.notify("Please fill in all fields", type="negative")
                 return
 
             try:
-                result = api_client.signup(username.value, password.value, name.value, email.value)
+                result = await api_client.signup(username.value, password.value, name.value, email.value)
+                app.storage.user["token"] = result.token.access_token
                 on_signup(result._id)
                 ui.notify("Signup successful! You can now log in.", type="positive")
                 ui.navigate.to("/overview")
-            except requests.HTTPError as e:
+            except httpx.HTTPStatusError as e:
                 if e.response.status_code == 400:
                     ui.notify("Username or email already exists", type="negative")
+                elif e.response.status_code == 503:
+                    ui.notify(f"The server is busy, try again in {e.response.headers.get('Retry-After', 'a few')} seconds", type="negative")
                 elif e.response.status_code == 500:
                     ui.notify("Server error. Please try again later.", type="negative")
                 else:
                     ui.notify(f"Signup failed: {str(e)}", type="negative")
-            except requests.exceptions.RequestException as e:
+            except httpx.HTTPError as e:
                 ui.notify(f"Signup failed: {str(e)}", type="negative")
 
         ui.button("Sign Up", on_click=handle_signup).classes("w-48 bg-green-500 text-white mb-4")
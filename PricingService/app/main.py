@@ -1,13 +1,18 @@
 # from dotenv import load_dotenv
 # load_dotenv()
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel, Field
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List
 import httpx
 import json
+import math
 import os
 
+from .occupancy import snapshot, consumer
+from .rates import rate_table, RateTable, bucket_floor, BUCKET_MINUTES, HORIZON_DAYS, MINUTES_PER_DAY
+
 app = FastAPI(
     version="1.1.0",
     summary="Written By Prevail Awoleye",
@@ -24,15 +29,49 @@ BASE_PRICES = {
 
 MAIN_APP_URL = os.getenv('MAIN_APP_URL')
 
+MAX_QUOTE_INTERVALS = 1000
+
+@app.on_event("startup")
+async def subscribe_to_spot_events():
+    consumer.start()
+
+@app.on_event("shutdown")
+async def unsubscribe_from_spot_events():
+    await consumer.stop()
+
 class PriceRequest(BaseModel):
     timestamp: datetime = Field(..., example="2025-03-08T16:30:00")
     
 class PriceResponse(BaseModel):
     minute_rate: float = Field(..., example=0.12)
 
+class QuoteInterval(BaseModel):
+    start: datetime = Field(..., example="2025-03-08T11:30:00")
+    end: datetime = Field(..., example="2025-03-08T12:30:00")
+
+class QuoteRequest(BaseModel):
+    intervals: List[QuoteInterval] = Field(..., min_length=1, max_length=MAX_QUOTE_INTERVALS)
+
+class IntervalQuote(BaseModel):
+    start: datetime = Field(..., example="2025-03-08T11:30:00")
+    end: datetime = Field(..., example="2025-03-08T12:30:00")
+    minutes: int = Field(..., example=60)
+    total_price: float = Field(..., example=7.5)
+
+class QuoteResponse(BaseModel):
+    quotes: List[IntervalQuote]
+
+class RatesResponse(BaseModel):
+    start: datetime = Field(..., example="2025-03-08T16:30:00")
+    bucket_minutes: int = Field(..., example=BUCKET_MINUTES)
+    occupancy_rate: float = Field(..., example=0.4)
+    minute_rates: List[float] = Field(..., description="The per minute rate of each consecutive bucket from `start`")
+
 def get_base_price(timestamp: datetime) -> float:
+    return get_hourly_base_price(timestamp.hour)
+
+def get_hourly_base_price(hour: int) -> float:
 
-    hour = timestamp.hour
     if 0 <= hour < 12:
         return BASE_PRICES["morning"]
     elif 12 <= hour < 18:
@@ -44,19 +83,68 @@ async def fetch_spot_data():
 
     async with httpx.AsyncClient() as client:
         try:
-            # Fetch total spots
-            total_response = await client.get(f"{MAIN_APP_URL}/spots")
-            total_spots_json = json.loads(total_response.content)
-            total_spots = total_spots_json['count']
-            # Fetch occupied spots
-            occupied_response = await client.get(f"{MAIN_APP_URL}/spots?filter=status%3Aeq%3Aoccupied")
-            occupied_spots_json = json.loads(occupied_response.content)
-            occupied_spots = occupied_spots_json['count']
+            # Fetch the spot counts, aggregated by the main app
+            stats_response = await client.get(f"{MAIN_APP_URL}/spots/stats")
+            stats_json = json.loads(stats_response.content)
+            total_spots = stats_json['total']
+            occupied_spots = stats_json['occupied']
 
             return total_spots, occupied_spots
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to fetch spot data: {str(e)}")
 
+async def current_occupancy():
+    """Returns the total and occupied spot counts from the event driven snapshot, falling
+    back to the main app (and resyncing the snapshot) when the snapshot is too old"""
+
+    if snapshot.is_fresh():
+        return snapshot.total, snapshot.occupied
+
+    total_spots, occupied_spots = await fetch_spot_data()
+    snapshot.reset(total_spots, occupied_spots)
+    return total_spots, occupied_spots
+
+async def current_occupancy_rate() -> float:
+
+    total_spots, occupied_spots = await current_occupancy()
+
+    if total_spots == 0:
+        raise HTTPException(status_code=400, detail="No parking spots available")
+    
+    return occupied_spots / total_spots
+
+def minute_rate_cents(base_price: float, occupancy_rate: float) -> int:
+    """The per minute rate in whole cents, rounded the same way /calculate-rate rounds it"""
+    return round(round((1 + occupancy_rate) * base_price, 2) * 100)
+
+async def current_rate_table() -> RateTable:
+    """Returns the rate table, rebuilding it first if the occupancy rate changed since it was built"""
+
+    occupancy_rate = await current_occupancy_rate()
+    now = datetime.now()
+    if not rate_table.is_current(occupancy_rate, now):
+        hourly_cents = [minute_rate_cents(get_hourly_base_price(hour), occupancy_rate) for hour in range(24)]
+        rate_table.rebuild(occupancy_rate, hourly_cents, now)
+    return rate_table
+
+def quote_interval(cumulative: List[int], start: datetime, end: datetime) -> tuple[int, float]:
+    """Prices an interval minute by minute, each started minute at the rate of the band it starts in.
+    `cumulative` holds the prefix sums of one day of minute rates in cents, so any span of minutes
+    is a subtraction. Returns the number of minutes charged (rounded up) and the total price."""
+
+    minutes = math.ceil((end - start).total_seconds() / 60)
+    first = start.hour * 60 + start.minute
+    full_days, remaining = divmod(minutes, MINUTES_PER_DAY)
+
+    cents = full_days * cumulative[MINUTES_PER_DAY]
+    stop = first + remaining
+    if stop <= MINUTES_PER_DAY:
+        cents += cumulative[stop] - cumulative[first]
+    else:
+        cents += cumulative[MINUTES_PER_DAY] - cumulative[first] + cumulative[stop - MINUTES_PER_DAY]
+
+    return minutes, cents / 100
+
 @app.post(
     path="/calculate-rate",
     summary="Returns the pricing rate per minute",
@@ -64,17 +152,59 @@ async def fetch_spot_data():
     status_code=200
 )
 async def calculate_price(request: PriceRequest):
-    base_price = get_base_price(request.timestamp)
+    table = await current_rate_table()
 
-    total_spots, occupied_spots = await fetch_spot_data()
+    minute_rate = table.minute_rate(request.timestamp)
+    if minute_rate is None:
+        # Outside the table, so computed directly
+        final_price = (1 + table.occupancy_rate) * get_base_price(request.timestamp)
+        minute_rate = round(final_price, 2)
 
-    if total_spots == 0:
-        raise HTTPException(status_code=400, detail="No parking spots available")
-    
-    occupancy_rate = occupied_spots / total_spots
-    final_price = (1 + occupancy_rate) * base_price
+    return PriceResponse(minute_rate=minute_rate)
+
+@app.post(
+    path="/quote",
+    summary="Returns the total price of a batch of intervals",
+    description="Prices each interval minute by minute across the time band boundaries. Partial minutes are rounded up.",
+    response_model=QuoteResponse,
+    status_code=200
+)
+async def quote(request: QuoteRequest):
+    for interval in request.intervals:
+        if interval.end <= interval.start:
+            raise HTTPException(status_code=400, detail=f"Interval ending {interval.end} does not end after its start {interval.start}")
+
+    # The prefix sums are part of the rate table, so each interval is O(1)
+    cumulative = (await current_rate_table()).day_cumulative
+
+    quotes = []
+    for interval in request.intervals:
+        minutes, total_price = quote_interval(cumulative, interval.start, interval.end)
+        quotes.append(IntervalQuote(start=interval.start, end=interval.end, minutes=minutes, total_price=total_price))
+
+    return QuoteResponse(quotes=quotes)
+
+@app.get(
+    path="/rates",
+    summary="Returns the per minute rates over a time range",
+    description=f"Rates are published in {BUCKET_MINUTES} minute buckets from the start of today up to {HORIZON_DAYS} days ahead. "
+        f"Defaults to the next {HORIZON_DAYS} days. Price an interval by charging each started minute at the rate of the bucket it starts in.",
+    response_model=RatesResponse,
+    status_code=200
+)
+async def rates(from_: datetime | None = Query(None, alias="from"), to: datetime | None = None):
+    table = await current_rate_table()
+
+    start = bucket_floor((from_ or datetime.now()).replace(tzinfo=None))
+    end = to.replace(tzinfo=None) if to else start + timedelta(days=HORIZON_DAYS)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="`to` must be after `from`")
+
+    minute_rates = table.minute_rates(start, end)
+    if minute_rates is None:
+        raise HTTPException(status_code=400, detail=f"Rates are only published between {table.start} and {table.end}")
 
-    return PriceResponse(minute_rate=round(final_price, 2))
+    return RatesResponse(start=start, bucket_minutes=BUCKET_MINUTES, occupancy_rate=table.occupancy_rate, minute_rates=minute_rates)
 
 @app.get("/")
 async def root():
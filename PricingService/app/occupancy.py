@@ -0,0 +1,127 @@
+"""In-memory occupancy snapshot of the garage, kept current by the spot status change events
+the main app publishes, so pricing does not need to call the main app on every request."""
+
+import aio_pika
+import asyncio
+import json
+import os
+import time
+
+RABBIT_HOST = os.getenv('RABBIT_HOST')
+EXCHANGE_NAME = os.getenv('EXCHANGE_NAME')
+SPOT_STATUS_ROUTING_KEY = "spot_status"
+
+# The snapshot is trusted for this long after the last resync or event
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv('SNAPSHOT_MAX_AGE_SECONDS', '60'))
+MAX_RECONNECT_BACKOFF_SECONDS = 30
+
+
+class OccupancySnapshot:
+    """Total and occupied spot counts, moved incrementally by status change events"""
+
+    def __init__(self):
+        self.total = 0
+        self.occupied = 0
+        self.synced_at: float | None = None
+        self.updated_at: float | None = None
+        self.listening = False
+
+    def reset(self, total: int, occupied: int):
+        self.total = total
+        self.occupied = occupied
+        self.synced_at = time.monotonic()
+        self.updated_at = self.synced_at
+
+    def invalidate(self):
+        """Forces a resync, used whenever events may have been missed"""
+        self.synced_at = None
+
+    def apply(self, event: dict):
+        if self.synced_at is None:
+            return
+
+        previous_status, status = event.get("previous_status"), event.get("status")
+        if previous_status is None:
+            self.total += 1
+        if status is None:
+            self.total -= 1
+        if previous_status == "occupied":
+            self.occupied -= 1
+        if status == "occupied":
+            self.occupied += 1
+        self.updated_at = time.monotonic()
+
+    def is_fresh(self, max_age: float = SNAPSHOT_MAX_AGE_SECONDS) -> bool:
+        if not self.listening or self.synced_at is None:
+            return False
+        return time.monotonic() - self.updated_at <= max_age
+
+
+snapshot = OccupancySnapshot()
+
+
+class OccupancyConsumer:
+    """Consumes spot status change events from the exchange into the snapshot"""
+
+    def __init__(self, snapshot: OccupancySnapshot):
+        self.snapshot = snapshot
+        self._connection: aio_pika.abc.AbstractRobustConnection | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._connection is not None and not self._connection.is_closed:
+            await self._connection.close()
+        self.snapshot.listening = False
+
+    async def _run(self):
+        # connect_robust recovers dropped connections by itself, this loop only covers the first connect
+        backoff = 1
+        while True:
+            try:
+                await self._subscribe()
+                return
+            except Exception as e:
+                print(f"Could not subscribe to spot status events: {e}. Retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF_SECONDS)
+
+    async def _subscribe(self):
+        self._connection = await aio_pika.connect_robust(host=RABBIT_HOST, port=5672)
+        self._connection.close_callbacks.add(self._on_disconnect)
+        self._connection.reconnect_callbacks.add(self._on_reconnect)
+
+        channel = await self._connection.channel()
+        exchange = await channel.declare_exchange(EXCHANGE_NAME, aio_pika.ExchangeType.DIRECT, durable=True)
+        queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(exchange, routing_key=SPOT_STATUS_ROUTING_KEY)
+        await queue.consume(self._on_message, no_ack=True)
+
+        self.snapshot.invalidate()
+        self.snapshot.listening = True
+        print("Subscribed to spot status events")
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        try:
+            self.snapshot.apply(json.loads(message.body))
+        except (ValueError, KeyError) as e:
+            print(f"Ignoring malformed spot status event: {e}")
+
+    def _on_disconnect(self, *args):
+        self.snapshot.listening = False
+
+    def _on_reconnect(self, *args):
+        # Events published while disconnected are lost, so the counts are resynced
+        self.snapshot.invalidate()
+        self.snapshot.listening = True
+
+
+consumer = OccupancyConsumer(snapshot)
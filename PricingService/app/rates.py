@@ -0,0 +1,80 @@
+"""Precomputed per minute rates in fixed size buckets covering the next week, so pricing
+requests are served by lookups instead of recomputing the rate on every call. The table is
+rebuilt whenever the occupancy rate it was built from changes, or when the day rolls over."""
+
+from datetime import datetime, timedelta
+from typing import List
+
+BUCKET_MINUTES = 5
+HORIZON_DAYS = 7
+MINUTES_PER_DAY = 24 * 60
+BUCKETS_PER_DAY = MINUTES_PER_DAY // BUCKET_MINUTES
+
+
+def bucket_floor(timestamp: datetime) -> datetime:
+    """The start of the bucket `timestamp` falls in"""
+    return timestamp.replace(minute=timestamp.minute - timestamp.minute % BUCKET_MINUTES, second=0, microsecond=0)
+
+
+class RateTable:
+    """Per minute rates in whole cents for every bucket from midnight today until `HORIZON_DAYS`
+    days from now, plus the prefix sums of one day of minute rates used to quote intervals.
+
+    Timestamps are compared by wall clock time, matching how the base price only looks at the hour.
+    """
+
+    def __init__(self):
+        self.occupancy_rate: float | None = None
+        self.start: datetime | None = None
+        self.cents: List[int] = []
+        self.day_cumulative: List[int] = []
+        self.rebuilds = 0
+
+    @property
+    def end(self) -> datetime | None:
+        if self.start is None:
+            return None
+        return self.start + timedelta(minutes=len(self.cents) * BUCKET_MINUTES)
+
+    def is_current(self, occupancy_rate: float, now: datetime) -> bool:
+        return self.occupancy_rate == occupancy_rate and self.start == now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def rebuild(self, occupancy_rate: float, hourly_cents: List[int], now: datetime):
+        """Fills the table from the per minute rate (in cents) of each hour of the day"""
+
+        day = [hourly_cents[(bucket * BUCKET_MINUTES) // 60] for bucket in range(BUCKETS_PER_DAY)]
+        # One extra day so the horizon is always a full week ahead of the current time
+        self.cents = day * (HORIZON_DAYS + 1)
+
+        cumulative = [0] * (MINUTES_PER_DAY + 1)
+        for minute in range(MINUTES_PER_DAY):
+            cumulative[minute + 1] = cumulative[minute] + hourly_cents[minute // 60]
+        self.day_cumulative = cumulative
+
+        self.occupancy_rate = occupancy_rate
+        self.start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.rebuilds += 1
+
+    def bucket_index(self, timestamp: datetime) -> int | None:
+        """The bucket `timestamp` falls in, or None when it is outside the table"""
+        timestamp = timestamp.replace(tzinfo=None)
+        if self.start is None or not self.start <= timestamp < self.end:
+            return None
+        return int((timestamp - self.start).total_seconds() // (BUCKET_MINUTES * 60))
+
+    def minute_rate(self, timestamp: datetime) -> float | None:
+        index = self.bucket_index(timestamp)
+        if index is None:
+            return None
+        return self.cents[index] / 100
+
+    def minute_rates(self, start: datetime, end: datetime) -> List[float] | None:
+        """The rates of every bucket overlapping [start, end), or None when the range leaves the table"""
+        first = self.bucket_index(start)
+        last = self.bucket_index(end - timedelta(microseconds=1))
+        if first is None or last is None:
+            return None
+        return [cents / 100 for cents in self.cents[first:last + 1]]
+
+
+rate_table = RateTable()
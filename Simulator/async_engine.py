@@ -0,0 +1,234 @@
+"""Asyncio simulation engine. Every spot is a task instead of a process, and the spots of a
+shard share one AMQP connection and one HTTP session, so a single host can drive thousands
+of spots. One shard runs per core, each on its own event loop in its own process."""
+
+import aio_pika
+import aiohttp
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from simulator import CENTRAL_API, RABBIT_SERVER, RABBIT_PORT, EXCHANGE_NAME
+from reservation_store import ReservationStore
+from status_batcher import AsyncStatusBatcher, status_update
+from sensor_events import AsyncSensorEventPublisher
+
+#A spot is marked reserved this many seconds before the reservation starts
+RESERVE_LEAD_SECONDS = 50
+#AMQP channels per shard, queue declarations for the shard's spots are spread across them
+CHANNELS_PER_SHARD = 8
+HTTP_CONNECTIONS_PER_SHARD = 100
+
+
+def seconds_until(epoch: int) -> float:
+    return epoch - time.time()
+
+
+class AsyncSpot():
+    def __init__(self, id: str, floor_level: int, spot_number: int, session: aiohttp.ClientSession, status: str = "vacant", batcher: AsyncStatusBatcher | None = None, sensor_publisher: AsyncSensorEventPublisher | None = None):
+        self.id = id
+        self.floor_level = floor_level
+        self.spot_number = spot_number
+        self.status = status
+        self.session = session
+        self.batcher = batcher
+        self.sensor_publisher = sensor_publisher
+
+        self.reservations = ReservationStore()
+        #Set when a reservation arrives or is cancelled so the spot re-checks its next deadline
+        self.wake = asyncio.Event()
+
+        self.queue_name = f"Reservation_{self.id}"
+        self.routing_key = f"spot_{self.id}"
+
+
+    async def subscribe(self, channel: aio_pika.abc.AbstractChannel, exchange: aio_pika.abc.AbstractExchange):
+        queue = await channel.declare_queue(self.queue_name, durable=True)
+        await queue.bind(exchange, routing_key=self.routing_key)
+        await queue.consume(self.process_reservation, no_ack=True)
+
+
+    async def process_reservation(self, message: aio_pika.abc.AbstractIncomingMessage):
+        """Handle message from server that a reservation was created or cancelled"""
+        reservation = json.loads(message.body.decode())
+        print(f"Sim {self.id}: Got reservation {reservation}")
+
+        reservation_id = reservation.get("reservation_id", f"{reservation["start_time"]}/{reservation["end_time"]}")
+        if reservation.get("event") == "cancelled":
+            self.reservations.cancel(reservation_id)
+        else:
+            self.reservations.push(
+                reservation_id,
+                datetime.fromisoformat(reservation["start_time"]),
+                datetime.fromisoformat(reservation["end_time"])
+            )
+        self.wake.set()
+
+
+    def reservation_due(self) -> bool:
+        earliest = self.reservations.peek()
+        return earliest is not None and seconds_until(earliest[0]) <= RESERVE_LEAD_SECONDS
+
+
+    async def run(self):
+        while True:
+            if self.reservation_due():
+                await self.hold_reservation()
+            else:
+                await self.simulate_parking()
+
+
+    async def hold_reservation(self):
+        """Holds the spot for the earliest reservation: reserved shortly before it starts,
+        occupied for its duration, then vacant. A cancellation frees the spot straight away."""
+        start, end, reservation_id = self.reservations.peek()
+
+        await self.update_API_status("reserved")
+        if await self.wait_until(start, reservation_id):
+            await self.update_API_status("occupied")
+            await self.wait_until(end, reservation_id)
+        self.reservations.cancel(reservation_id)
+
+        #Back to back reservations are handed over without freeing the spot
+        if not self.reservation_due():
+            await self.update_API_status("vacant")
+
+
+    async def wait_until(self, epoch: int, reservation_id: str) -> bool:
+        """Waits until `epoch`, returning False early if the reservation is cancelled"""
+        while reservation_id in self.reservations:
+            remaining = seconds_until(epoch)
+            if remaining <= 0:
+                return True
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+
+    async def simulate_parking(self):
+        """Randomly make the spot available and occupied, giving way as soon as a reservation is due"""
+        if not await self.idle(random.randint(10, 40)):
+            return
+        if self.status == "vacant":
+            await self.update_API_status("occupied")
+        if not await self.idle(random.randint(5, 20)):
+            return
+        if self.status == "occupied":
+            await self.update_API_status("vacant")
+        await self.idle(random.randint(5, 20))
+
+
+    async def idle(self, seconds: float) -> bool:
+        """Waits `seconds`, returning False early if a reservation becomes due in the meantime"""
+        deadline = asyncio.get_running_loop().time() + seconds
+        while True:
+            if self.reservation_due():
+                return False
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return True
+            earliest = self.reservations.peek()
+            if earliest is not None:
+                remaining = min(remaining, seconds_until(earliest[0]) - RESERVE_LEAD_SECONDS)
+
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def update_API_status(self, status: str):
+        self.status = status
+        if self.batcher is not None:
+            self.batcher.add(self.id, status)
+            return
+        if self.sensor_publisher is not None:
+            await self.sensor_publisher.publish([status_update(self.id, status)])
+            return
+        try:
+            async with self.session.put(f"/spots/{self.id}", json={"status": status, "observed_at": datetime.now(timezone.utc).isoformat()}) as response:
+                response.raise_for_status()
+        except aiohttp.ClientError as e:
+            print(f"Sim {self.id}: Failed to update status to {status}: {e}")
+
+
+async def run_shard(spots_data: list[dict], stop_event, batch_ms: int = 0, transport: str = "http"):
+    headers = {
+        "accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    connector = aiohttp.TCPConnector(limit=HTTP_CONNECTIONS_PER_SHARD)
+
+    async with aiohttp.ClientSession(base_url=CENTRAL_API, headers=headers, connector=connector) as session:
+        connection = await aio_pika.connect_robust(host=RABBIT_SERVER, port=RABBIT_PORT)
+        async with connection:
+            channels = [await connection.channel() for _ in range(CHANNELS_PER_SHARD)]
+            exchanges = [
+                await channel.declare_exchange(EXCHANGE_NAME, aio_pika.ExchangeType.DIRECT, durable=True)
+                for channel in channels
+            ]
+
+            sensor_publisher = None
+            if transport == "amqp":
+                publish_channel = await connection.channel()
+                publish_exchange = await publish_channel.declare_exchange(EXCHANGE_NAME, aio_pika.ExchangeType.DIRECT, durable=True)
+                sensor_publisher = await AsyncSensorEventPublisher.declare(publish_channel, publish_exchange)
+            batcher = AsyncStatusBatcher(session, batch_ms, sensor_publisher) if batch_ms > 0 else None
+
+            spots = [
+                AsyncSpot(
+                    id=spot_data["_id"],
+                    floor_level=spot_data["floor_level"],
+                    spot_number=spot_data["spot_number"],
+                    session=session,
+                    status=spot_data["status"],
+                    batcher=batcher,
+                    sensor_publisher=sensor_publisher
+                )
+                for spot_data in spots_data
+            ]
+
+            async def subscribe_all(i: int):
+                for spot in spots[i::CHANNELS_PER_SHARD]:
+                    await spot.subscribe(channels[i], exchanges[i])
+
+            await asyncio.gather(*(subscribe_all(i) for i in range(CHANNELS_PER_SHARD)))
+            print(f"Shard {os.getpid()}: Simulating {len(spots)} spots")
+
+            if batcher is not None:
+                batcher.start()
+            tasks = [asyncio.create_task(spot.run()) for spot in spots]
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, stop_event.wait)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if batcher is not None:
+                    await batcher.stop()
+
+
+def run_shard_process(spots_data: list[dict], stop_event, batch_ms: int = 0, transport: str = "http"):
+    try:
+        asyncio.run(run_shard(spots_data, stop_event, batch_ms, transport))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_shards(spots: list[dict], stop_event, shards: int | None = None, batch_ms: int = 0, transport: str = "http") -> list[multiprocessing.Process]:
+    """Splits the spots across one event loop per core and starts a process for each"""
+    shards = max(1, min(shards or os.cpu_count() or 1, len(spots)))
+    processes = []
+    for shard in range(shards):
+        p = multiprocessing.Process(target=run_shard_process, args=(spots[shard::shards], stop_event, batch_ms, transport))
+        p.start()
+        processes.append(p)
+    return processes
@@ -0,0 +1,83 @@
+"""Thread-safe store of a spot's upcoming reservations, ordered by start time."""
+
+import heapq
+import math
+import threading
+import time
+from datetime import datetime
+
+
+def to_epoch(timestamp: datetime, round_up: bool = False) -> int:
+    seconds = timestamp.timestamp()
+    return math.ceil(seconds) if round_up else math.floor(seconds)
+
+
+class ReservationStore():
+    """Min-heap of `(start, end, reservation_id)` tuples, with start and end as epoch seconds.
+    Inserting and popping the earliest reservation are O(log n). Cancelling is O(1): the
+    reservation is forgotten straight away and its heap entry is skipped once it reaches the top.
+
+    Every method takes the store's lock, so the consumer thread can insert and cancel while
+    the simulation reads the earliest reservation.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[int, int, str]] = []
+        self._live: set[str] = set()
+        self._lock = threading.Lock()
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._live)
+
+
+    def __contains__(self, reservation_id: str) -> bool:
+        with self._lock:
+            return reservation_id in self._live
+
+
+    def push(self, reservation_id: str, start_time: datetime, end_time: datetime) -> tuple[int, int, str] | None:
+        """Adds a reservation and returns its entry. Returns None and ignores a reservation that is
+        already in the store or has already ended, as a redelivered message may be."""
+        entry = (to_epoch(start_time), to_epoch(end_time, round_up=True), reservation_id)
+        if entry[1] <= time.time():
+            return None
+        with self._lock:
+            if reservation_id in self._live:
+                return None
+            self._live.add(reservation_id)
+            heapq.heappush(self._heap, entry)
+        return entry
+
+
+    def cancel(self, reservation_id: str) -> bool:
+        """Removes a reservation. Returns False if it was not in the store"""
+        with self._lock:
+            if reservation_id not in self._live:
+                return False
+            self._live.remove(reservation_id)
+            return True
+
+
+    def peek(self) -> tuple[int, int, str] | None:
+        """The earliest reservation, without removing it"""
+        with self._lock:
+            self._drop_cancelled()
+            return self._heap[0] if self._heap else None
+
+
+    def pop(self) -> tuple[int, int, str] | None:
+        """Removes and returns the earliest reservation"""
+        with self._lock:
+            self._drop_cancelled()
+            if not self._heap:
+                return None
+            entry = heapq.heappop(self._heap)
+            self._live.remove(entry[2])
+            return entry
+
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2] not in self._live:
+            heapq.heappop(self._heap)
@@ -0,0 +1,91 @@
+"""Heap based timer scheduler for the process engine. A single thread sleeps until the earliest
+deadline and runs its callback, so wakeups scale with the number of events instead of with
+the number of spots times the number of seconds simulated."""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class TimerHandle():
+    __slots__ = ("when", "seq", "callback", "args", "cancelled")
+
+    def __init__(self, when: float, seq: int, callback, args: tuple):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other: "TimerHandle") -> bool:
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        """Cancelled timers stay in the heap and are skipped when they come due"""
+        self.cancelled = True
+
+
+class Scheduler():
+    """Runs callbacks at their deadline (epoch seconds) on one thread. Callbacks run one at a
+    time, so state only touched from callbacks needs no lock."""
+
+    def __init__(self):
+        self._heap: list[TimerHandle] = []
+        self._condition = threading.Condition()
+        self._seq = itertools.count()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+
+    def call_at(self, when: float, callback, *args) -> TimerHandle:
+        """Schedules `callback(*args)` at the epoch time `when`. Safe to call from any thread."""
+        handle = TimerHandle(when, next(self._seq), callback, args)
+        with self._condition:
+            heapq.heappush(self._heap, handle)
+            #Only an earlier deadline than the one being waited on needs to wake the thread
+            if self._heap[0] is handle:
+                self._condition.notify()
+        return handle
+
+
+    def call_later(self, delay: float, callback, *args) -> TimerHandle:
+        return self.call_at(time.time() + delay, callback, *args)
+
+
+    def call_soon(self, callback, *args) -> TimerHandle:
+        return self.call_at(time.time(), callback, *args)
+
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0].when - time.time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if self._stopped:
+                    return
+                handle = heapq.heappop(self._heap)
+
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                print(f"Error in scheduled callback {handle.callback.__name__}: {e}")
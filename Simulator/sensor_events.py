@@ -0,0 +1,82 @@
+"""Publishes spot status updates to the `sensor_events` queue the central API consumes, as an
+alternative to sending them over HTTP. A message carries `{"updates": [...]}`."""
+
+import aio_pika
+import json
+import pika
+import pika.exceptions
+import threading
+
+SENSOR_EVENTS_QUEUE = "sensor_events"
+
+
+class SensorEventPublisher():
+    """Blocking publisher for the process engine. pika connections are not thread safe, so
+    publishes are serialised, and the connection is re-opened when the broker dropped it."""
+
+    def __init__(self, host: str, port: int, exchange: str):
+        self.parameters = pika.ConnectionParameters(host, port)
+        self.exchange = exchange
+        self._connection: pika.BlockingConnection | None = None
+        self._channel = None
+        self._lock = threading.Lock()
+
+
+    def _connect(self):
+        self._connection = pika.BlockingConnection(self.parameters)
+        self._channel = self._connection.channel()
+        self._channel.exchange_declare(exchange=self.exchange, exchange_type="direct", durable=True)
+        self._channel.queue_declare(queue=SENSOR_EVENTS_QUEUE, durable=True)
+        self._channel.queue_bind(exchange=self.exchange, queue=SENSOR_EVENTS_QUEUE, routing_key=SENSOR_EVENTS_QUEUE)
+
+
+    def publish(self, updates: list[dict]):
+        body = json.dumps({"updates": updates})
+        with self._lock:
+            #One retry covers a connection the broker closed while it sat idle
+            for attempt in range(2):
+                try:
+                    if self._connection is None or self._connection.is_closed:
+                        self._connect()
+                    self._channel.basic_publish(
+                        exchange=self.exchange,
+                        routing_key=SENSOR_EVENTS_QUEUE,
+                        body=body,
+                        properties=pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent)
+                    )
+                    return
+                except pika.exceptions.AMQPError as e:
+                    self._connection = None
+                    if attempt == 1:
+                        print(f"Failed to publish {len(updates)} sensor events: {e}")
+
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+            self._connection = None
+
+
+class AsyncSensorEventPublisher():
+    """Publisher for the asyncio engine, on a channel of the shard's shared connection"""
+
+    def __init__(self, exchange: aio_pika.abc.AbstractExchange):
+        self.exchange = exchange
+
+
+    @classmethod
+    async def declare(cls, channel: aio_pika.abc.AbstractChannel, exchange: aio_pika.abc.AbstractExchange) -> "AsyncSensorEventPublisher":
+        queue = await channel.declare_queue(SENSOR_EVENTS_QUEUE, durable=True)
+        await queue.bind(exchange, routing_key=SENSOR_EVENTS_QUEUE)
+        return cls(exchange)
+
+
+    async def publish(self, updates: list[dict]):
+        try:
+            await self.exchange.publish(
+                aio_pika.Message(body=json.dumps({"updates": updates}).encode(), delivery_mode=aio_pika.DeliveryMode.PERSISTENT),
+                routing_key=SENSOR_EVENTS_QUEUE
+            )
+        except (aio_pika.exceptions.AMQPError, aio_pika.exceptions.ChannelInvalidStateError, ConnectionError) as e:
+            print(f"Failed to publish {len(updates)} sensor events: {e}")
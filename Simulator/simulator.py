@@ -1,28 +1,45 @@
 import pika.exceptions
 import requests
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import multiprocessing
 import random
 import pika
 import json
 import threading
+import argparse
+import queue
+import signal
+
+from scheduler import Scheduler, TimerHandle
+from reservation_store import ReservationStore
+from status_batcher import StatusBatcher, QueuedStatusBatcher, status_update
+from sensor_events import SensorEventPublisher
 
 
 CENTRAL_API = "https://central-api-gud7ethebpctcag5.canadacentral-01.azurewebsites.net/"
 RABBIT_SERVER, RABBIT_PORT = "4.248.248.109", 5672
 EXCHANGE_NAME = "res_exchange"
 
+#A spot is marked reserved this many seconds before the reservation starts
+RESERVE_LEAD_SECONDS = 50
+
 
 
 class Spot():
-    def __init__(self, id: str, floor_level: int, spot_number: int, status: str = "vacant"):
+    def __init__(self, id: str, floor_level: int, spot_number: int, scheduler: Scheduler, status: str = "vacant", batcher: StatusBatcher | QueuedStatusBatcher | None = None, sensor_publisher: SensorEventPublisher | None = None):
         self.id = id
         self.floor_level = floor_level
         self.spot_number = spot_number
         self.status = status
+        self.scheduler = scheduler
+        self.batcher = batcher
+        self.sensor_publisher = sensor_publisher
         
-        self.reservations: list[dict] = []
+        self.reservations = ReservationStore()
+        #Only touched from scheduler callbacks, which run one at a time
+        self.active_reservation: str | None = None
+        self.parking_timer: TimerHandle | None = None
         
         self.queue_name = f"Reservation_{self.id}"
         self.routing_key = f"spot_{self.id}"
@@ -63,142 +80,234 @@ class Spot():
         
         
     def process_reservation(self, channel, method, properties, body: bytes):
-        """Handle message from server that a reservation was created"""
+        """Handle message from server that a reservation was created or cancelled"""
         
         print(f"Sim {self.id}: Got message:")
         message = json.loads(body.decode())
         print(message)
         
-        #1. update internal status
-        reservation = {
-            "start_time": datetime.fromisoformat(message["start_time"]),
-            "end_time": datetime.fromisoformat(message["end_time"])    
-        }
-        # print(f"Inserting reservation: {reservation}")
+        start_time = datetime.fromisoformat(message["start_time"])
+        end_time = datetime.fromisoformat(message["end_time"])
+        reservation_id = message.get("reservation_id", f"{message["start_time"]}/{message["end_time"]}")
         
-        #2. insert reservation to self.reservations
-        self.reservations.append(reservation)
+        if message.get("event") == "cancelled":
+            self.scheduler.call_soon(self.cancel_reservation, reservation_id)
+            return
         
-        #3. sort the dict
-        self.reservations.sort(key=lambda x: x["start_time"])
+        #1. insert the reservation, the store is safe to use from this consumer thread
+        entry = self.reservations.push(reservation_id, start_time, end_time)
+        if entry is None:
+            print(f"Sim {self.id}: Ignoring reservation {reservation_id}, it is already scheduled or has ended")
+            return
+        start, end, _ = entry
         
-        if self.pause_simulation.is_set():
-            print("pause got set after procesing res")
-            
+        #2. schedule its reserve, occupy and vacate deadlines
+        self.scheduler.call_at(start - RESERVE_LEAD_SECONDS, self.reserve, reservation_id)
+        self.scheduler.call_at(start, self.occupy, reservation_id)
+        self.scheduler.call_at(end, self.vacate, reservation_id)
+    
     
     def start(self, stop_event):
+        if self.batcher is not None:
+            self.batcher.start()
+        self.schedule_parking(random.randint(10, 40))
+        self.scheduler.start()
+        stop_event.wait()
+        self.scheduler.stop()
+        if self.batcher is not None:
+            self.batcher.stop()
+        if self.sensor_publisher is not None:
+            self.sensor_publisher.close()
         
-        self.pause_simulation = threading.Event()
         
+    def reserve(self, reservation_id: str):
+        #Back to back reservations are handed over when the current one ends
+        if reservation_id not in self.reservations or self.active_reservation is not None:
+            return
+        self.pause_parking()
+        self.status = 'reserved'
+        self.update_API_status("reserved")
         
-        simulation_thread = threading.Thread(target=self.simulation_loop)
-        simulation_thread.daemon = True
-        simulation_thread.start()
         
-        while not stop_event.is_set():
-            
-            # print(f"In main while, reservations: {self.reservations}")
-            
-            if len(self.reservations) > 0 and (datetime.now() + timedelta(seconds=50)) >= self.reservations[0]["start_time"]:
-                if self.pause_simulation.is_set():
-                    print("inside if 1, pause is set")
-                else:
-                    print("inside if 1, pause is unset")
-                print(datetime.now())
-                print(self.reservations[0]["start_time"])
-                print(datetime.now() >= self.reservations[0]["start_time"])
-                self.status = 'reserved'
-                self.update_API_status("reserved")
-                time.sleep(49)
-                
-                
-            if len(self.reservations) > 0 and datetime.now() >= self.reservations[0]["start_time"]:
-                self.pause_simulation.set()
-                print("just set")
-                self.update_API_status("occupied")
-                # Wait until the current reservation ends
-                current_res = self.reservations[0]
-                # print(current_res)
-                while datetime.now() < current_res["end_time"]:
-                    time.sleep(1)
-                # Once finished, remove the reservation and resume simulation
-                self.status = 'vacant'
-                self.update_API_status("vacant")
-                self.reservations.pop(0)
-                self.pause_simulation.clear()
-                print("just unset")
-            else:
-                time.sleep(1)  # Check periodically
-
+    def occupy(self, reservation_id: str):
+        if reservation_id not in self.reservations:
+            return
+        self.pause_parking()
+        self.active_reservation = reservation_id
+        self.status = 'occupied'
+        self.update_API_status("occupied")
+        
+        
+    def vacate(self, reservation_id: str):
+        if self.active_reservation != reservation_id:
+            return
+        self.reservations.cancel(reservation_id)
+        self.active_reservation = None
+        self.release()
+        
+        
+    def cancel_reservation(self, reservation_id: str):
+        if not self.reservations.cancel(reservation_id):
+            return
+        if self.active_reservation == reservation_id:
+            self.active_reservation = None
+            self.release()
+        elif self.active_reservation is None and self.status == 'reserved':
+            self.release()
+        
+        
+    def release(self):
+        """Hands the spot to the next reservation if it is due, otherwise frees it"""
+        earliest = self.reservations.peek()
+        if earliest is not None and time.time() >= earliest[0] - RESERVE_LEAD_SECONDS:
+            self.status = 'reserved'
+            self.update_API_status("reserved")
+        else:
+            self.status = 'vacant'
+            self.update_API_status("vacant")
+            self.schedule_parking(random.randint(10, 40))
                 
                 
-    def simulation_loop(self):
-        """Continuously simulate parking if not paused."""
-        while True:
-            # Check if we should pause the simulation due to an active reservation
-            if self.pause_simulation.is_set():
-                time.sleep(1)  # Simply wait while paused
-                continue
-
-            # Run one cycle of the parking simulation
-            self.simulate_parking()
+    def schedule_parking(self, delay: float):
+        self.pause_parking()
+        self.parking_timer = self.scheduler.call_later(delay, self.simulate_parking)
+        
         
+    def pause_parking(self):
+        if self.parking_timer is not None:
+            self.parking_timer.cancel()
+            self.parking_timer = None
         
         
     def simulate_parking(self):
         """Randomly make the spot available and occupied"""
-        sleep_time = random.randint(10, 40)
-        time.sleep(sleep_time)
         if self.status == 'vacant':
             self.status = "occupied"
             self.update_API_status("occupied")
-        sleep_time = random.randint(5, 20)
-        time.sleep(sleep_time)
+        self.parking_timer = self.scheduler.call_later(random.randint(5, 20), self.simulate_leaving)
+        
+        
+    def simulate_leaving(self):
         if self.status == 'occupied':
             self.status = "vacant"
             self.update_API_status("vacant")
-        sleep_time = random.randint(5, 20)
-        time.sleep(sleep_time)
+        self.schedule_parking(random.randint(5, 20) + random.randint(10, 40))
         
         
     def update_API_status(self, status: str):
+        if self.batcher is not None:
+            self.batcher.add(self.id, status)
+            return
+        if self.sensor_publisher is not None:
+            self.sensor_publisher.publish([status_update(self.id, status)])
+            return
+        
         headers = {
             "accept": "application/json",
             "Content-Type": "application/json"
         }
         
-        spot_status_changed_response = requests.put(CENTRAL_API + f"spots/{self.id}", json={"status": status}, headers=headers)
+        spot_status_changed_response = requests.put(CENTRAL_API + f"spots/{self.id}", json={"status": status, "observed_at": datetime.now(timezone.utc).isoformat()}, headers=headers)
         spot = spot_status_changed_response.json()
         print(spot)
-        
-        
-    def check_reservations(self):
-        """Checks self.reservations to see if a reservation is currently active"""
 
 
-def run_spot(spot_data, stop_event):
+def run_spot(spot_data, stop_event, status_updates: multiprocessing.Queue | None = None, transport: str = "http"):
+    #When batching, the batcher process sends the updates and the spot needs no publisher of its own
+    sensor_publisher = SensorEventPublisher(RABBIT_SERVER, RABBIT_PORT, EXCHANGE_NAME) if transport == "amqp" and status_updates is None else None
     new_spot = Spot(
         id=spot_data["_id"],
         floor_level=spot_data["floor_level"],
         spot_number=spot_data["spot_number"],
-        status=spot_data["status"]
+        scheduler=Scheduler(),
+        status=spot_data["status"],
+        batcher=QueuedStatusBatcher(status_updates) if status_updates is not None else None,
+        sensor_publisher=sensor_publisher
     )
     new_spot.start(stop_event)
 
+
+def run_batcher(status_updates: multiprocessing.Queue, stop_event, batch_ms: int, transport: str = "http"):
+    """Batches the status updates of every spot process of the process engine"""
+    #Ctrl+C reaches every process, the parent sets `stop_event` once the spots have stopped
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sensor_publisher = SensorEventPublisher(RABBIT_SERVER, RABBIT_PORT, EXCHANGE_NAME) if transport == "amqp" else None
+    batcher = StatusBatcher(CENTRAL_API, batch_ms, sensor_publisher)
+    batcher.start()
+    while not stop_event.is_set():
+        try:
+            batcher.add_update(status_updates.get(timeout=0.5))
+        except queue.Empty:
+            continue
+    
+    #Send what the spots queued before they stopped
+    while True:
+        try:
+            batcher.add_update(status_updates.get_nowait())
+        except queue.Empty:
+            break
+    batcher.stop()
+    if sensor_publisher is not None:
+        sensor_publisher.close()
+
+def fetch_spots(all_spots: bool) -> list[dict]:
+    if not all_spots:
+        spots_response = requests.get(CENTRAL_API + "spots?filter=spot_number%3Aeq%3A1&filter=floor_level%3Aeq%3A0")
+        return spots_response.json()['records']
+
+    #Page through every spot in the garage
+    spots = []
+    params = {"limit": 1000}
+    while True:
+        page = requests.get(CENTRAL_API + "spots", params=params).json()
+        spots += page['records']
+        if page.get('next_cursor') is None:
+            return spots
+        params["after"] = page['next_cursor']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulates the parking spot sensors of the garage")
+    parser.add_argument("--engine", choices=["process", "asyncio"], default="process",
+                        help="process runs one process per spot, asyncio runs the spots as tasks on one event loop per core")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Number of event loops (processes) for the asyncio engine. Defaults to the number of cores")
+    parser.add_argument("--batch-ms", type=int, default=0,
+                        help="Coalesce status updates and send them in one batch every N milliseconds. Disabled by default")
+    parser.add_argument("--transport", choices=["http", "amqp"], default="http",
+                        help="Send status updates to the API over HTTP, or publish them to the sensor_events queue")
+    parser.add_argument("--all-spots", action="store_true",
+                        help="Simulate every spot in the garage instead of the single test spot")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    spots_response = requests.get(CENTRAL_API + "spots?filter=spot_number%3Aeq%3A1&filter=floor_level%3Aeq%3A0")
-    spots = spots_response.json()['records']
+    args = parse_args()
+    spots = fetch_spots(args.all_spots)
     stop_event = multiprocessing.Event()
-    processes = []
 
-    for spot in spots:
-        p = multiprocessing.Process(target=run_spot, args=(spot, stop_event))
-        p.start()
-        processes.append(p)
+    if args.engine == "asyncio":
+        from async_engine import start_shards
+        processes = start_shards(spots, stop_event, args.shards, args.batch_ms, args.transport)
+    else:
+        #With batching, one batcher process gathers the updates of every spot process
+        status_updates = multiprocessing.Queue() if args.batch_ms > 0 else None
+        if status_updates is not None:
+            batcher_stop_event = multiprocessing.Event()
+            batcher_process = multiprocessing.Process(target=run_batcher, args=(status_updates, batcher_stop_event, args.batch_ms, args.transport))
+            batcher_process.start()
+        processes = []
+        for spot in spots:
+            p = multiprocessing.Process(target=run_spot, args=(spot, stop_event, status_updates, args.transport))
+            p.start()
+            processes.append(p)
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         stop_event.set()
         for p in processes:
-            p.join()
\ No newline at end of file
+            p.join()
+        if args.engine == "process" and status_updates is not None:
+            batcher_stop_event.set()
+            batcher_process.join()
\ No newline at end of file
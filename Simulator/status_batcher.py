@@ -0,0 +1,159 @@
+"""Coalesces spot status updates and sends them to PUT /spots/status:batch (or the sensor events
+queue) every few milliseconds, instead of one request per state change. Only the latest update
+of a spot within an interval is sent."""
+
+import aiohttp
+import asyncio
+import multiprocessing
+import requests
+import threading
+from datetime import datetime, timezone
+
+from sensor_events import SensorEventPublisher, AsyncSensorEventPublisher
+
+#The most updates the API accepts in one batch
+MAX_BATCH_SIZE = 1000
+
+
+def status_update(spot_id: str, status: str) -> dict:
+    return {
+        "spot_id": spot_id,
+        "status": status,
+        "observed_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def report_rejected(results: list[dict]):
+    for result in results:
+        if result["result"] != "applied":
+            print(f"Sim {result["spot_id"]}: Status update {result["result"]}: {result.get("detail")}")
+
+
+class StatusBatcher():
+    """Thread based batcher for the process engine"""
+
+    def __init__(self, central_api: str, interval_ms: int, publisher: SensorEventPublisher | None = None):
+        self.url = central_api + "spots/status:batch"
+        self.interval = interval_ms / 1000
+        self.session = requests.Session()
+        self.publisher = publisher
+
+        self._pending: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+
+    def add(self, spot_id: str, status: str):
+        self.add_update(status_update(spot_id, status))
+
+
+    def add_update(self, update: dict):
+        with self._lock:
+            self._pending[update["spot_id"]] = update
+
+
+    def flush(self):
+        with self._lock:
+            updates, self._pending = list(self._pending.values()), {}
+
+        for i in range(0, len(updates), MAX_BATCH_SIZE):
+            if self.publisher is not None:
+                self.publisher.publish(updates[i:i + MAX_BATCH_SIZE])
+                continue
+            try:
+                response = self.session.put(self.url, json={"updates": updates[i:i + MAX_BATCH_SIZE]})
+                response.raise_for_status()
+                report_rejected(response.json()["results"])
+            except requests.RequestException as e:
+                print(f"Failed to send {len(updates[i:i + MAX_BATCH_SIZE])} status updates: {e}")
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+class QueuedStatusBatcher():
+    """Stands in for the batcher in every spot process of the process engine. Updates are put on a
+    queue read by a single batcher process, so one batch carries the changes of every spot."""
+
+    def __init__(self, updates: multiprocessing.Queue):
+        self.updates = updates
+
+
+    def start(self):
+        pass
+
+
+    def stop(self):
+        pass
+
+
+    def add(self, spot_id: str, status: str):
+        #Stamped here, so the observation time does not include the wait in the queue
+        self.updates.put(status_update(spot_id, status))
+
+
+class AsyncStatusBatcher():
+    """Event loop based batcher for the asyncio engine, shared by every spot of a shard"""
+
+    def __init__(self, session: aiohttp.ClientSession, interval_ms: int, publisher: AsyncSensorEventPublisher | None = None):
+        self.session = session
+        self.interval = interval_ms / 1000
+        self.publisher = publisher
+
+        self._pending: dict[str, dict] = {}
+        self._task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        #The task is not cancelled, so a flush in progress finishes instead of losing its batch
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+    def add(self, spot_id: str, status: str):
+        self._pending[spot_id] = status_update(spot_id, status)
+
+
+    async def flush(self):
+        updates, self._pending = list(self._pending.values()), {}
+
+        for i in range(0, len(updates), MAX_BATCH_SIZE):
+            if self.publisher is not None:
+                await self.publisher.publish(updates[i:i + MAX_BATCH_SIZE])
+                continue
+            try:
+                async with self.session.put("/spots/status:batch", json={"updates": updates[i:i + MAX_BATCH_SIZE]}) as response:
+                    response.raise_for_status()
+                    report_rejected((await response.json())["results"])
+            except aiohttp.ClientError as e:
+                print(f"Failed to send {len(updates[i:i + MAX_BATCH_SIZE])} status updates: {e}")
+
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+                return
+            except asyncio.TimeoutError:
+                await self.flush()